@@ -0,0 +1,140 @@
+# 按小批量遍历已构建的数据集：按 epoch 设种子打乱、多机按 rank 切分、后台线程预取
+import os  # 操作系统接口
+from collections import deque  # 预取队列
+from concurrent.futures import ThreadPoolExecutor  # 线程池
+import numpy as np  # 数值计算库
+from dataset_io import load_dataset  # 数据集读取
+
+
+class BatchLoader:
+    """
+    小批量迭代器，每个批次为 (paths, captions, labels)，read_images=True 时再加上图像的原始字节
+
+    参数:
+    data_dict: load_dataset 读取的数据集字典
+    batch_size: 批大小
+    shuffle: 是否每个 epoch 打乱，打乱顺序只由 seed 和 epoch 决定
+    seed: 随机种子，所有 rank 必须相同
+    rank, world_size: 多机/多卡时当前进程的编号和总进程数，
+                      每个 rank 读取互不重叠的一段（各 rank 样本数相同，余数丢弃）
+    drop_last: 是否丢弃最后一个不满的批次
+    prefetch: 预取的批次数
+    workers: 预取线程数
+    read_images: 是否在后台线程中读取图像字节
+    image_root: 图像根目录，indexs 中的路径相对该目录
+
+    用法:
+    loader = BatchLoader(load_dataset("pkl_dataset/coco2017.pkl"), batch_size=128, rank=rank, world_size=world_size)
+    for epoch in range(epochs):
+        loader.set_epoch(epoch)
+        for paths, captions, labels in loader:
+            ...
+    """
+
+    def __init__(self, data_dict, batch_size: int = 64, shuffle: bool = True, seed: int = 0,
+                 rank: int = 0, world_size: int = 1, drop_last: bool = False,
+                 prefetch: int = 4, workers: int = 2, read_images: bool = False, image_root: str = ""):
+        if not 0 <= rank < world_size:
+            raise ValueError(f"rank={rank} 不在 [0, {world_size}) 范围内")
+        self.indexs = data_dict["indexs"]
+        self.captions = data_dict["captions"]
+        # 标签统一为一个连续的 int8 矩阵，每个批次从中按行取出
+        self.labels = np.ascontiguousarray(np.asarray(data_dict["labels"], dtype=np.int8))
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.seed = seed
+        self.rank = rank
+        self.world_size = world_size
+        self.drop_last = drop_last
+        self.prefetch = max(prefetch, 1)
+        self.workers = max(workers, 1)
+        self.read_images = read_images
+        self.image_root = image_root
+        self.epoch = 0
+
+    @classmethod
+    def from_pkl(cls, pkl_path, **kwargs):
+        """从pkl文件（含追加分段）创建"""
+        return cls(load_dataset(pkl_path), **kwargs)
+
+    def set_epoch(self, epoch: int):
+        """设置当前 epoch，shuffle=True 时不同 epoch 的顺序不同，相同 epoch 在所有 rank 上一致"""
+        self.epoch = epoch
+
+    def shard_rows(self):
+        """当前 rank 在本 epoch 中读取的行号"""
+        n = len(self.indexs)
+        per_rank = n // self.world_size
+        start = self.rank * per_rank
+        if self.shuffle:
+            order = np.random.default_rng([self.seed, self.epoch]).permutation(n)
+            return order[start:start + per_rank]
+        return np.arange(start, start + per_rank)
+
+    def batches(self):
+        """当前 rank 本 epoch 的批次划分，每个元素为一个批次的行号数组"""
+        rows = self.shard_rows()
+        end = len(rows) - len(rows) % self.batch_size if self.drop_last else len(rows)
+        return [rows[s:min(s + self.batch_size, end)] for s in range(0, end, self.batch_size)]
+
+    def __len__(self):
+        return len(self.batches())
+
+    def load_batch(self, rows):
+        """读取一个批次；行号连续时标签直接取矩阵的切片（不复制）"""
+        if len(rows) and np.all(np.diff(rows) == 1):
+            labels = self.labels[rows[0]:rows[-1] + 1]
+        else:
+            labels = self.labels[rows]
+        rows = rows.tolist()
+        paths = [self.indexs[i] for i in rows]
+        captions = [self.captions[i] for i in rows]
+        if not self.read_images:
+            return paths, captions, labels
+        images = []
+        for path in paths:
+            with open(os.path.join(self.image_root, path), "rb") as f:
+                images.append(f.read())
+        return paths, captions, labels, images
+
+    def __iter__(self):
+        batches = iter(self.batches())
+        pool = ThreadPoolExecutor(max_workers=self.workers)
+        pending = deque()
+        try:
+            # 先提交 prefetch 个批次，之后每取走一个批次再提交一个
+            for rows in batches:
+                pending.append(pool.submit(self.load_batch, rows))
+                if len(pending) >= self.prefetch:
+                    break
+            while pending:
+                batch = pending.popleft().result()
+                rows = next(batches, None)
+                if rows is not None:
+                    pending.append(pool.submit(self.load_batch, rows))
+                yield batch
+        finally:
+            pool.shutdown(wait=True, cancel_futures=True)
+
+
+# 主程序入口：统计遍历一个 epoch 的速度
+if __name__ == "__main__":
+    import time  # 计时
+    import argparse  # 命令行参数解析库
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("pkl", type=str, help="已构建的pkl文件，如 pkl_dataset/coco2017.pkl")
+    parser.add_argument("--batch-size", default=128, type=int, help="批大小")
+    parser.add_argument("--rank", default=0, type=int, help="当前进程编号")
+    parser.add_argument("--world-size", default=1, type=int, help="总进程数")
+    parser.add_argument("--image-root", default=None, type=str, help="指定后同时读取图像字节")
+    args = parser.parse_args()
+
+    loader = BatchLoader.from_pkl(args.pkl, batch_size=args.batch_size, rank=args.rank,
+                                  world_size=args.world_size, read_images=args.image_root is not None,
+                                  image_root=args.image_root or "")
+    start = time.time()
+    num = 0
+    for batch in loader:
+        num += len(batch[0])
+    print(f"批次数={len(loader)}, 样本数={num}, 用时={time.time() - start:.2f}s")
@@ -0,0 +1,141 @@
+# 构建检查点：每个阶段的中间结果保存到临时目录，中断后用 --resume 从第一个未完成的阶段继续
+import os  # 操作系统接口
+import json  # JSON处理库
+import pickle  # Python内置的序列化模块
+
+# 默认的临时目录根目录，每个数据集一个子目录
+SCRATCH_ROOT = "build_cache"
+# 检查点的参数文件，同时作为“该目录是检查点目录”的标记
+CONFIG_NAME = "checkpoint.json"
+
+
+# 给构建脚本添加检查点参数
+def add_checkpoint_args(parser, name: str):
+    parser.add_argument("--resume", action="store_true",
+                        help="从上次中断的构建继续，跳过已完成的阶段")
+    parser.add_argument("--scratch-dir", default=os.path.join(SCRATCH_ROOT, name), type=str,
+                        help="保存各阶段中间结果的临时目录，构建成功后删除")
+    return parser
+
+
+class BuildCheckpoint:
+    """
+    分阶段构建的检查点
+
+    参数:
+    scratch_dir: 临时目录，每个阶段写入 {阶段名}.pkl，写完后再写完成标记 {阶段名}.done；
+                 清理时只删除这些文件和 checkpoint.json，不删除目录中的其他文件
+    stages: 所有阶段名，按执行顺序排列；同时执行的几条分支写成一个列表，
+            每条分支是一个阶段名列表，如 [[train阶段...], [val阶段...]], "merge", ...
+    resume: 是否继续上次的构建；否则清空临时目录从头开始
+    config: 本次构建的参数（可JSON序列化），与上次不同时不能继续，从头开始
+
+    功能说明:
+    继续构建时，每条分支内找到第一个没有完成标记的阶段，它之前的阶段直接读取保存的结果，
+    它及之后的阶段全部重新执行（后面的阶段依赖前面的结果）；
+    分支之间互不影响，分支之后的阶段要等所有分支都已完成才能跳过。
+    对象可以传给子进程，子进程中执行的阶段同样会写入检查点。
+    """
+
+    def __init__(self, scratch_dir: str, stages: list, resume: bool = False, config: dict = None):
+        self.scratch_dir = scratch_dir
+        self.stages = list(stages)
+        self.names = [name for item in self.stages for name in ([item] if isinstance(item, str) else sum(item, []))]
+        config_path = os.path.join(scratch_dir, CONFIG_NAME)
+
+        if resume and os.path.exists(config_path):
+            with open(config_path, "r", encoding="utf-8") as f:
+                if json.load(f) != config:
+                    print("构建参数与上次不同，从头开始构建")
+                    resume = False
+        if not resume:
+            self._clear()
+        os.makedirs(scratch_dir, exist_ok=True)
+        with open(config_path, "w", encoding="utf-8") as f:
+            json.dump(config, f, ensure_ascii=False)
+
+        # 可以直接读取结果的阶段
+        self.reuse = set()
+        if resume:
+            self.reuse = self._completed(self.stages)
+            rerun = [name for name in self.names if name not in self.reuse]
+            if rerun:
+                print(f"继续构建：重新执行阶段 {rerun}")
+            else:
+                print("继续构建：所有阶段均已完成")
+
+    def _completed(self, stages):
+        """按依赖关系找出可以跳过的阶段：本身和它依赖的所有阶段都有完成标记"""
+        completed = set()
+        ok = True  # 前面的阶段是否全部完成
+        for item in stages:
+            if isinstance(item, str):
+                ok = ok and os.path.exists(self._marker(item))
+                if ok:
+                    completed.add(item)
+                continue
+            # 同时执行的分支：每条分支单独判断，分支之后的阶段要求所有分支都已完成
+            all_ok = ok
+            for branch in item:
+                branch_ok = ok
+                for name in branch:
+                    branch_ok = branch_ok and os.path.exists(self._marker(name))
+                    if branch_ok:
+                        completed.add(name)
+                all_ok = all_ok and branch_ok
+            ok = all_ok
+        return completed
+
+    def _clear(self):
+        """删除本类写入的文件（各阶段的 .pkl、.pkl.tmp、.done 和 checkpoint.json），没有 checkpoint.json 的目录不动"""
+        config_path = os.path.join(self.scratch_dir, CONFIG_NAME)
+        if not os.path.exists(config_path):
+            return
+        for name in self.names:
+            for path in [self._data(name), self._data(name) + ".tmp", self._marker(name)]:
+                if os.path.exists(path):
+                    os.remove(path)
+        os.remove(config_path)
+
+    def _marker(self, name):
+        return os.path.join(self.scratch_dir, f"{name}.done")
+
+    def _data(self, name):
+        return os.path.join(self.scratch_dir, f"{name}.pkl")
+
+    def stage(self, name: str, fn, *args, **kwargs):
+        """
+        执行一个阶段：已完成的直接读取保存的结果，否则调用 fn(*args, **kwargs) 并保存结果
+        """
+        if name in self.reuse:
+            with open(self._data(name), "rb") as f:
+                return pickle.load(f)
+
+        result = fn(*args, **kwargs)
+        # 先写临时文件再改名，最后写完成标记，中断时不会留下不完整的阶段
+        tmp_path = self._data(name) + ".tmp"
+        with open(tmp_path, "wb") as f:
+            pickle.dump(result, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, self._data(name))
+        open(self._marker(name), "w").close()
+        return result
+
+    def finish(self):
+        """构建成功后删除检查点文件；临时目录和默认根目录 build_cache 为空时也一起删除"""
+        self._clear()
+        dirs = [self.scratch_dir]
+        parent = os.path.dirname(os.path.abspath(self.scratch_dir))
+        if parent == os.path.abspath(SCRATCH_ROOT):
+            dirs.append(parent)
+        for path in dirs:
+            try:
+                os.rmdir(path)  # 目录中还有其他文件（如其他数据集的临时目录）时不为空，保留
+            except OSError:
+                pass
+
+
+# 不使用检查点时的替代：直接执行
+def run_stage(checkpoint, name: str, fn, *args, **kwargs):
+    if checkpoint is None:
+        return fn(*args, **kwargs)
+    return checkpoint.stage(name, fn, *args, **kwargs)
@@ -0,0 +1,557 @@
+# 数据集读写工具：各 make_*.py 构建脚本共用的保存/导出函数
+import os  # 操作系统接口
+import pickle  # Python内置的序列化模块
+import shutil  # 删除目录
+import numpy as np  # 数值计算库
+
+# mat 导出时每个分块的最大图像数，超过后拆分为 index_0.mat、index_1.mat ...
+MAT_CHUNK_ROWS = 200000
+
+
+# 给构建脚本添加统一的输出参数
+def add_output_args(parser):
+    """
+    给构建脚本的命令行解析器添加统一的输出参数
+
+    参数:
+    parser: argparse.ArgumentParser
+    """
+    parser.add_argument("--format", default="pkl", choices=["pkl", "mat"],
+                        help="输出格式：pkl（Python）或 mat（MATLAB）")
+    parser.add_argument("--save-dir", default="./pkl_dataset", type=str,
+                        help="PKL文件保存目录")
+    parser.add_argument("--mat-dir", default="./mat_dataset", type=str,
+                        help="MAT文件保存目录，每个数据集一个子目录")
+    parser.add_argument("--mat-chunk", default=MAT_CHUNK_ROWS, type=int,
+                        help="MAT文件每个分块的最大图像数")
+    return parser
+
+
+# 字符串列表 -> 定宽字符矩阵
+def to_char_matrix(strings):
+    """
+    将字符串列表转换为定宽的numpy字符串数组
+
+    savemat 会把定宽字符串数组写成 char 矩阵（每行一个字符串，右侧补空格），
+    比 object 数组写成的 cell 数组小得多，MATLAB 读取也快得多。
+    """
+    width = max((len(s) for s in strings), default=1)
+    return np.array(strings, dtype=f"U{max(width, 1)}")
+
+
+# 统一 captions 的结构
+def flatten_captions(captions):
+    """
+    将每张图像的描述展平为一维列表
+
+    参数:
+    captions: 每个元素为一条描述（str）或多条描述（list）
+
+    返回:
+    flat: 所有描述按图像顺序展平后的列表
+    counts: 每张图像的描述条数，int32数组
+    """
+    flat = []
+    counts = np.zeros(len(captions), dtype=np.int32)
+    for i, caps in enumerate(captions):
+        if isinstance(caps, str):
+            caps = [caps]
+        flat.extend(caps)
+        counts[i] = len(caps)
+    return flat, counts
+
+
+# 字符串列表 <-> 紧凑数组（跨进程传递时比pickle字符串列表小得多、快得多）
+def pack_strings(strings):
+    """
+    将字符串列表编码为一段UTF-8字节和偏移量
+
+    返回:
+    blob: uint8数组，所有字符串UTF-8编码后首尾相接
+    offsets: int64数组 [len(strings) + 1]，第 i 个字符串为 blob[offsets[i]:offsets[i+1]]
+    """
+    encoded = [item.encode("utf-8") for item in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(item) for item in encoded], out=offsets[1:])
+    blob = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+    return blob, offsets
+
+
+def unpack_strings(blob, offsets):
+    """pack_strings 的逆操作，返回字符串列表"""
+    data = blob.tobytes()
+    return [data[s:e].decode("utf-8") for s, e in zip(offsets[:-1].tolist(), offsets[1:].tolist())]
+
+
+# 按行划分分块
+def chunk_bounds(n, chunk_rows):
+    """返回 [(start, end), ...]，每块最多 chunk_rows 行"""
+    chunk_rows = max(int(chunk_rows), 1)
+    return [(s, min(s + chunk_rows, n)) for s in range(0, max(n, 1), chunk_rows)]
+
+
+# 逐行追加的数据集写入器
+class DatasetWriter:
+    """
+    逐行追加数据集，用于流式构建
+
+    标签写入预分配的 int8 块（每块 block_rows 行），不需要先构建完整的标签矩阵，
+    内存只随实际保留的行数增长。
+    """
+
+    def __init__(self, num_classes: int, block_rows: int = 65536):
+        self.num_classes = num_classes
+        self.block_rows = block_rows
+        self.indexs = []  # 图片索引
+        self.captions = []  # 文本描述
+        self.ids = []  # 源数据集中的图像ID
+        self._blocks = []  # 标签块
+        self._fill = block_rows  # 最后一块已写入的行数
+
+    def __len__(self):
+        return len(self.indexs)
+
+    def append(self, index, caption, label, source_id):
+        # 最后一块写满时再分配新块
+        if self._fill == self.block_rows:
+            self._blocks.append(np.zeros((self.block_rows, self.num_classes), dtype=np.int8))
+            self._fill = 0
+        self._blocks[-1][self._fill] = label
+        self._fill += 1
+        self.indexs.append(index)
+        self.captions.append(caption)
+        self.ids.append(source_id)
+
+    def finish(self, split: int = 0):
+        """返回 {"indexs", "captions", "labels", "ids", "splits"}，labels 为 [行数, 类别数] 的 int8 矩阵"""
+        if not self._blocks:
+            labels = np.zeros((0, self.num_classes), dtype=np.int8)
+        elif len(self._blocks) == 1:
+            labels = self._blocks[0][:self._fill]
+        else:
+            labels = np.concatenate(self._blocks)[:len(self.indexs)]
+        return {"indexs": self.indexs,  # 图片索引
+                "captions": self.captions,  # 文本描述
+                "labels": labels,  # 标签矩阵
+                "ids": np.array(self.ids, dtype=np.int64),  # 源数据集中的图像ID
+                "splits": np.full(len(self.ids), split, dtype=np.int8)}  # 所属子集
+
+
+# ============ 保存为pkl格式文件 ============
+def save_pkl(data_dict, save_dir, name):
+    os.makedirs(save_dir, exist_ok=True)
+    # 追加分段中的数据不在原始标注文件中，完整重建不包含这些数据，不能直接覆盖
+    segments = list_segments(os.path.join(save_dir, f"{name}.pkl"))
+    if segments:
+        raise FileExistsError(f"存在{len(segments)}个追加分段 {segment_dir(os.path.join(save_dir, f'{name}.pkl'))}，"
+                              f"完整重建不包含这些数据。请先备份或移走该目录，再用 --resume 继续写入")
+    #  保存为pickle格式（Python原生，加载最快）
+    # "wb"参数：w=写入模式，b=二进制模式（pickle需要二进制）
+    with open(os.path.join(save_dir, f"{name}.pkl"), "wb") as f:
+        pickle.dump(data_dict, f)
+    save_ids(data_dict, os.path.join(save_dir, f"{name}.pkl"))
+    return save_dir
+
+
+# ============ 保存为mat格式文件 ============
+def save_mat(data_dict, mat_dir, name, chunk_rows=MAT_CHUNK_ROWS):
+    """
+    将数据集导出为MATLAB可读的 mat 文件（开启压缩）
+
+    目录结构与 mat_dataset/ 中已有文件一致：
+        {mat_dir}/{name}/index.mat    变量 index：图像路径，char矩阵 [N, 宽度]
+        {mat_dir}/{name}/caption.mat  变量 caption：全部描述，char矩阵 [M, 宽度]
+                                      变量 caption_count：每张图像的描述条数 [N, 1]
+        {mat_dir}/{name}/label.mat    变量 category：标签矩阵 int8 [N, 类别数]
+        {mat_dir}/{name}/id.mat       变量 id、split：源数据集中的图像ID和所属子集 [N, 1]（数据集有 ids 列时）
+    图像数超过 chunk_rows 时按图像拆分为 index_0.mat、index_1.mat ...，
+    每个分块内的三个文件行对齐。
+    """
+    import scipy.io as scio  # MATLAB文件读写库
+
+    out_dir = os.path.join(mat_dir, name)
+    os.makedirs(out_dir, exist_ok=True)
+
+    indexs = data_dict["indexs"]
+    flat, counts = flatten_captions(data_dict["captions"])
+    labels = np.asarray(data_dict["labels"], dtype=np.int8)
+    # 每张图像的第一条描述在 flat 中的位置
+    offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+
+    bounds = chunk_bounds(len(indexs), chunk_rows)
+    for k, (s, e) in enumerate(bounds):
+        suffix = "" if len(bounds) == 1 else f"_{k}"
+        # 逐块转换字符串，避免一次性生成整个数据集的定宽数组
+        scio.savemat(os.path.join(out_dir, f"index{suffix}.mat"),
+                     {"index": to_char_matrix(indexs[s:e])},
+                     do_compression=True, oned_as="column")
+        scio.savemat(os.path.join(out_dir, f"caption{suffix}.mat"),
+                     {"caption": to_char_matrix(flat[offsets[s]:offsets[e]]),
+                      "caption_count": counts[s:e]},
+                     do_compression=True, oned_as="column")
+        scio.savemat(os.path.join(out_dir, f"label{suffix}.mat"),
+                     {"category": labels[s:e]},
+                     do_compression=True, oned_as="column")
+        if "ids" in data_dict:
+            scio.savemat(os.path.join(out_dir, f"id{suffix}.mat"),
+                         {"id": np.asarray(data_dict["ids"][s:e], dtype=np.int64),
+                          "split": np.asarray(data_dict["splits"][s:e], dtype=np.int8)},
+                         do_compression=True, oned_as="column")
+    return out_dir
+
+
+# ============ 读取已构建的数据集 ============
+def load_pkl(pkl_path):
+    with open(pkl_path, "rb") as f:
+        return pickle.load(f)
+
+
+# 追加分段所在目录：pkl_dataset/coco2017.pkl -> pkl_dataset/coco2017_segments/
+def segment_dir(pkl_path):
+    return os.path.splitext(pkl_path)[0] + "_segments"
+
+
+# 合并分段时使用的临时路径：改名后的分段目录、合并后的新主文件
+def compaction_paths(pkl_path):
+    return segment_dir(pkl_path) + ".compacting", pkl_path + ".compact"
+
+
+# 完成上次中断的合并
+def recover_compaction(pkl_path):
+    """
+    compact_dataset 先写好合并后的新主文件，再把分段目录改名为 .compacting，最后替换主文件。
+    分段目录已改名时说明新主文件已经写完：还没替换就替换，然后删除改名后的分段目录；
+    分段目录没有改名时新主文件可能不完整，直接删除，分段保持不变。
+    """
+    old_dir, new_path = compaction_paths(pkl_path)
+    if os.path.isdir(old_dir):
+        if os.path.exists(new_path):
+            os.replace(new_path, pkl_path)
+        shutil.rmtree(old_dir)
+    elif os.path.exists(new_path):
+        os.remove(new_path)
+
+
+# 按追加顺序列出所有分段
+def list_segments(pkl_path):
+    recover_compaction(pkl_path)  # 读取前先完成上次中断的合并，避免分段中的行被算两次或丢失
+    seg_dir = segment_dir(pkl_path)
+    if not os.path.isdir(seg_dir):
+        return []
+    names = sorted(item for item in os.listdir(seg_dir) if item.startswith("seg_") and item.endswith(".pkl"))
+    return [os.path.join(seg_dir, item) for item in names]
+
+
+# 按行拼接多个数据集
+def concat_datasets(parts):
+    """
+    按顺序拼接多个数据集字典，各列类型以第一个数据集为准（list 或 numpy数组）
+    """
+    parts = [part for part in parts if part]
+    if len(parts) == 1:
+        return parts[0]
+    result = {}
+    for key, value in parts[0].items():
+        if isinstance(value, np.ndarray):
+            result[key] = np.concatenate([np.asarray(part[key]) for part in parts])
+        else:
+            result[key] = [item for part in parts for item in part[key]]
+    return result
+
+
+# 图像ID旁路文件：coco2017.pkl -> coco2017_ids.npz，seg_00001.pkl -> seg_00001_ids.npz
+def ids_path(pkl_path):
+    return os.path.splitext(pkl_path)[0] + "_ids.npz"
+
+
+def save_ids(data_dict, pkl_path):
+    """把 ids、splits 两列另存一份，追加数据时不用读取整个数据集就能检查图像ID是否重复"""
+    if "ids" not in data_dict:
+        return
+    ids = np.asarray(data_dict["ids"], dtype=np.int64)
+    splits = np.asarray(data_dict.get("splits", np.zeros(len(ids))), dtype=np.int8)
+    tmp_path = ids_path(pkl_path) + ".tmp"
+    with open(tmp_path, "wb") as f:
+        np.savez(f, ids=ids, splits=splits)
+    os.replace(tmp_path, ids_path(pkl_path))
+
+
+def load_ids(pkl_path):
+    """
+    读取主文件和所有追加分段的 ids、splits 列，返回 {"ids", "splits"}（可直接用于 IdIndex）
+
+    旁路文件不存在或比对应的pkl旧时，从pkl中读取并重新保存；有数据没有 ids 列时返回 None
+    """
+    segments = list_segments(pkl_path)  # 先列出分段（会完成中断的合并），再读取主文件
+    paths = ([pkl_path] if os.path.exists(pkl_path) else []) + segments
+    ids, splits = [], []
+    for path in paths:
+        side_path = ids_path(path)
+        if os.path.exists(side_path) and os.path.getmtime(side_path) >= os.path.getmtime(path):
+            with np.load(side_path) as f:
+                part = {"ids": f["ids"], "splits": f["splits"]}
+        else:
+            part = load_pkl(path)
+            if "ids" not in part:
+                return None
+            save_ids(part, path)
+        ids.append(np.asarray(part["ids"], dtype=np.int64))
+        splits.append(np.asarray(part.get("splits", np.zeros(len(part["ids"]))), dtype=np.int8))
+    return {"ids": np.concatenate(ids) if ids else np.zeros(0, dtype=np.int64),
+            "splits": np.concatenate(splits) if splits else np.zeros(0, dtype=np.int8)}
+
+
+def load_dataset(pkl_path):
+    """
+    读取 make_*.py 生成的pkl文件，返回 {"indexs", "captions", "labels"} 字典
+
+    如果存在追加分段（append_segment 写入），按追加顺序拼接在主文件之后，
+    作为一个完整的数据集返回。
+    """
+    segments = list_segments(pkl_path)  # 先列出分段（会完成中断的合并），再读取主文件
+    parts = [load_pkl(pkl_path)] if os.path.exists(pkl_path) else []
+    parts += [load_pkl(path) for path in segments]
+    if not parts:
+        raise FileNotFoundError(pkl_path)
+    return concat_datasets(parts)
+
+
+# ============ 数据校验 ============
+def validate_dataset(data_dict, expected_indexs=None, ordered=True):
+    """
+    逐行校验数据集（全部为向量化的数组比较），返回所有问题的描述列表
+
+    检查内容:
+    1. 各列长度一致
+    2. 每行至少有一个标签、至少有一条描述
+    3. 有 ids 列时，行按 (split, id) 严格递增排列；ordered=False 时（行不按ID排序，如 NUS-WIDE）
+       只检查同一子集中没有重复的ID
+    4. 给定 expected_indexs 时，图像路径逐行相等
+    """
+    errors = []
+    indexs = data_dict["indexs"]
+    n = len(indexs)
+    for key, value in data_dict.items():
+        if len(value) != n:
+            errors.append(f"列长度不一致: {key}={len(value)}, indexs={n}")
+    if errors:
+        return errors
+
+    labels = np.asarray(data_dict["labels"])
+    if labels.ndim != 2:
+        return [f"标签不是二维矩阵: shape={labels.shape}"]
+    for i in np.flatnonzero(labels.sum(axis=1) == 0):
+        errors.append(f"标签为空: 行={i}, {indexs[i]}")
+
+    caption_counts = np.fromiter((len(caps) for caps in data_dict["captions"]), dtype=np.int64, count=n)
+    for i in np.flatnonzero(caption_counts == 0):
+        errors.append(f"描述为空: 行={i}, {indexs[i]}")
+
+    if "ids" in data_dict:
+        ids = np.asarray(data_dict["ids"], dtype=np.int64)
+        splits = np.asarray(data_dict.get("splits", np.zeros(n)), dtype=np.int64)
+        if ordered:
+            bad = (splits[1:] < splits[:-1]) | ((splits[1:] == splits[:-1]) & (ids[1:] <= ids[:-1]))
+            for i in np.flatnonzero(bad) + 1:
+                errors.append(f"行顺序错误: 行={i}, id={ids[i]}, split={splits[i]}, 上一行 id={ids[i - 1]}, split={splits[i - 1]}")
+        else:
+            order = np.lexsort((ids, splits))
+            dup = (ids[order][1:] == ids[order][:-1]) & (splits[order][1:] == splits[order][:-1])
+            for i, j in zip(order[:-1][dup].tolist(), order[1:][dup].tolist()):
+                errors.append(f"图像ID重复: id={ids[j]}, split={splits[j]}, 行={i} 和 行={j}")
+
+    if expected_indexs is not None:
+        if len(expected_indexs) != n:
+            errors.append(f"图像路径数量不一致: {n} vs {len(expected_indexs)}")
+        else:
+            for i in np.flatnonzero(np.asarray(indexs) != np.asarray(expected_indexs)):
+                errors.append(f"图像路径不一致: 行={i}, {indexs[i]} vs {expected_indexs[i]}")
+    return errors
+
+
+def check_dataset(data_dict, expected_indexs=None, errors=None, ordered=True):
+    """
+    校验数据集并打印所有问题，有问题时抛出 ValueError
+
+    参数:
+    errors: 额外的问题列表（如构建脚本自己的检查结果），一起报告
+    ordered: 见 validate_dataset
+    """
+    errors = list(errors or []) + validate_dataset(data_dict, expected_indexs, ordered)
+    for error in errors:
+        print(error)
+    if errors:
+        raise ValueError(f"数据校验失败，共{len(errors)}处问题")
+    print(f"数据校验通过: {len(data_dict['indexs'])}行")
+
+
+# ============ 按源数据集图像ID查找行号 ============
+class IdIndex:
+    """
+    源数据集图像ID -> 数据集行号的索引
+
+    构建时对 (ids, splits) 排序一次，之后每次查询都是向量化的 searchsorted，
+    每个ID的查询为 O(log N)，用于把外部标注、预测结果按图像ID对齐到数据集的行。
+
+    用法:
+    index = IdIndex(load_dataset("pkl_dataset/coco2017.pkl"))
+    rows = index.rows_for_ids([139, 285])  # 不存在的ID返回 -1
+    """
+
+    def __init__(self, data_dict):
+        if "ids" not in data_dict:
+            raise KeyError("数据集没有 ids 列，请用新版 make_*.py 重新构建")
+        ids = np.asarray(data_dict["ids"], dtype=np.int64)
+        splits = np.asarray(data_dict.get("splits", np.zeros(len(ids))), dtype=np.int64)
+        # 组合键 = id * 子集数 + split，排序结果等价于先按 id、再按 split 排序
+        self._num_splits = int(splits.max()) + 1 if len(splits) else 1
+        keys = ids * self._num_splits + splits
+        self._order = np.argsort(keys, kind="stable")
+        self._keys = keys[self._order]
+
+    def __len__(self):
+        return len(self._keys)
+
+    def rows_for_ids(self, ids, splits=None):
+        """
+        查找图像ID对应的行号
+
+        参数:
+        ids: 图像ID（标量或数组）
+        splits: 所属子集（标量或数组），为 None 时返回该ID所在的第一个子集中的行
+
+        返回:
+        rows: int64数组，与 ids 形状相同，找不到的为 -1
+        """
+        ids = np.asarray(ids, dtype=np.int64)
+        if len(self._keys) == 0:
+            return np.full(ids.shape, -1, dtype=np.int64)
+        if splits is None:
+            query = ids * self._num_splits
+        else:
+            splits = np.broadcast_to(np.asarray(splits, dtype=np.int64), ids.shape)
+            query = ids * self._num_splits + np.clip(splits, 0, self._num_splits - 1)
+
+        pos = np.searchsorted(self._keys, query, side="left")
+        pos_safe = np.minimum(pos, len(self._keys) - 1)
+        found_keys = self._keys[pos_safe]
+        if splits is None:
+            found = (pos < len(self._keys)) & (found_keys // self._num_splits == ids)
+        else:
+            found = (pos < len(self._keys)) & (found_keys == query) & (splits < self._num_splits) & (splits >= 0)
+        return np.where(found, self._order[pos_safe], -1)
+
+
+# ============ 追加写入与合并 ============
+def _dump_atomic(data_dict, path):
+    """先写临时文件再改名，中断时不会留下写了一半的pkl"""
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        pickle.dump(data_dict, f)
+    os.replace(tmp_path, path)
+    save_ids(data_dict, path)
+
+
+def append_segment(data_dict, pkl_path):
+    """
+    把新增的数据作为一个分段追加到数据集，不改写主文件和已有分段
+
+    返回:
+    新分段的路径，如 pkl_dataset/coco2017_segments/seg_00001.pkl
+    """
+    seg_dir = segment_dir(pkl_path)
+    os.makedirs(seg_dir, exist_ok=True)
+    segments = list_segments(pkl_path)
+    number = int(os.path.basename(segments[-1])[4:-4]) + 1 if segments else 1
+    path = os.path.join(seg_dir, f"seg_{number:05d}.pkl")
+    _dump_atomic(data_dict, path)
+    return path
+
+
+def compact_dataset(pkl_path):
+    """
+    把主文件和所有分段合并写回主文件，然后删除分段
+
+    任何一步中断都不会让分段中的行被读取两次：新主文件写完后，先把分段目录改名，
+    再替换主文件，下次读取时 recover_compaction 完成剩下的步骤
+
+    返回:
+    合并的分段数
+    """
+    segments = list_segments(pkl_path)
+    if not segments:
+        return 0
+    data_dict = load_dataset(pkl_path)
+    old_dir, new_path = compaction_paths(pkl_path)
+    with open(new_path, "wb") as f:
+        pickle.dump(data_dict, f)
+    os.replace(segment_dir(pkl_path), old_dir)
+    os.replace(new_path, pkl_path)
+    save_ids(data_dict, pkl_path)
+    shutil.rmtree(old_dir)
+    return len(segments)
+
+
+# 按行号取出子集
+def take_rows(data_dict, rows):
+    """
+    按行号从数据集中取出子集，各列保持原来的类型（list 或 numpy数组）
+
+    参数:
+    data_dict: 数据集字典
+    rows: 行号数组
+
+    返回:
+    与 data_dict 键相同的新字典
+    """
+    rows = np.asarray(rows, dtype=np.int64)
+    result = {}
+    for key, value in data_dict.items():
+        if isinstance(value, np.ndarray):
+            result[key] = value[rows]
+        else:
+            result[key] = [value[i] for i in rows]
+    return result
+
+
+# 按命令行参数选择输出格式
+def save_dataset(data_dict, args, name):
+    """
+    按 args.format 保存数据集，返回输出目录
+
+    参数:
+    data_dict: {"indexs": 图片索引, "captions": 文本描述, "labels": 标签矩阵}
+    args: add_output_args 添加过参数的解析结果
+    name: 数据集名称，如 "coco2017"
+    """
+    if args.format == "mat":
+        return save_mat(data_dict, args.mat_dir, name, args.mat_chunk)
+    return save_pkl(data_dict, args.save_dir, name)
+
+
+# 主程序入口：mat 将已有的pkl转换为mat；compact 合并追加的分段
+if __name__ == "__main__":
+    import argparse  # 命令行参数解析库
+
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    mat_parser = subparsers.add_parser("mat", help="将已构建的pkl（含追加分段）导出为mat")
+    mat_parser.add_argument("pkl", type=str, help="已构建的pkl文件，如 pkl_dataset/coco2017.pkl")
+    mat_parser.add_argument("--mat-dir", default="./mat_dataset", type=str,
+                            help="MAT文件保存目录")
+    mat_parser.add_argument("--mat-chunk", default=MAT_CHUNK_ROWS, type=int,
+                            help="MAT文件每个分块的最大图像数")
+
+    compact_parser = subparsers.add_parser("compact", help="将追加的分段合并进主pkl文件")
+    compact_parser.add_argument("pkl", type=str, help="已构建的pkl文件，如 pkl_dataset/coco2017.pkl")
+    args = parser.parse_args()
+
+    if args.command == "mat":
+        data_dict = load_dataset(args.pkl)
+        name = os.path.splitext(os.path.basename(args.pkl))[0]
+        print(f"finished!see {save_mat(data_dict, args.mat_dir, name, args.mat_chunk)}")
+    else:
+        print(f"合并分段数: {compact_dataset(args.pkl)}")
+        print(f"finished!see {args.pkl}")
@@ -0,0 +1,126 @@
+# 标签统计：类别频数、每个样本的标签数、类别共现矩阵，结果缓存为与数据集同名的 _stats.npz / _stats.json
+import os  # 操作系统接口
+import json  # JSON处理库
+import numpy as np  # 数值计算库
+from dataset_io import load_dataset, list_segments  # 数据集读取
+
+
+# 一次计算全部统计量
+def compute_stats(labels):
+    """
+    计算标签矩阵的统计量
+
+    参数:
+    labels: 标签矩阵 [样本数, 类别数]，0/1，list 或 numpy数组
+
+    返回:
+    stats: {
+        "counts": 每个类别的样本数 [类别数]，
+        "cooccurrence": 类别共现矩阵 [类别数, 类别数]，对角线等于 counts，
+        "cardinality_hist": 标签数为 k 的样本数 [类别数 + 1]，
+    }
+    """
+    labels = np.asarray(labels, dtype=np.int8)
+    n, num_classes = labels.shape
+
+    counts = labels.sum(axis=0, dtype=np.int64)  # 按列求和
+    per_row = labels.sum(axis=1, dtype=np.int64)  # 按行求和
+    cardinality_hist = np.bincount(per_row, minlength=num_classes + 1)
+
+    # 共现矩阵 = L^T L；样本数小于 2^24 时 float32 可以精确表示所有计数，走 BLAS 矩阵乘法
+    if n < (1 << 24):
+        packed = labels.astype(np.float32)
+        cooccurrence = (packed.T @ packed).astype(np.int32)
+    else:
+        packed = labels.astype(np.int64)
+        cooccurrence = packed.T @ packed
+
+    return {"counts": counts,
+            "cooccurrence": cooccurrence,
+            "cardinality_hist": cardinality_hist}
+
+
+# 汇总为便于阅读的JSON
+def stats_summary(stats, class_names=None):
+    counts = stats["counts"]
+    hist = stats["cardinality_hist"]
+    n = int(hist.sum())
+    num_classes = len(counts)
+    if class_names is None:
+        class_names = [str(i) for i in range(num_classes)]
+    return {"num_samples": n,
+            "num_classes": num_classes,
+            "class_names": list(class_names),
+            "class_counts": {name: int(num) for name, num in zip(class_names, counts)},
+            "label_cardinality": float((hist * np.arange(len(hist))).sum() / max(n, 1)),  # 平均每个样本的标签数
+            "label_density": float(counts.sum() / max(n * num_classes, 1)),  # 标签矩阵中1的比例
+            "cardinality_hist": [int(num) for num in hist],
+            "empty_samples": int(hist[0])}
+
+
+# 统计文件路径：pkl_dataset/coco2017.pkl -> pkl_dataset/coco2017_stats.npz / .json
+def stats_paths(out_dir, name):
+    base = os.path.join(out_dir, f"{name}_stats")
+    return base + ".npz", base + ".json"
+
+
+# 计算并保存统计量
+def save_stats(labels, out_dir, name, class_names=None):
+    """计算标签统计量并写入 {out_dir}/{name}_stats.npz 和 _stats.json，返回 stats"""
+    stats = compute_stats(labels)
+    npz_path, json_path = stats_paths(out_dir, name)
+    os.makedirs(out_dir, exist_ok=True)
+    np.savez_compressed(npz_path, **stats)
+    with open(json_path, "w", encoding="utf-8") as f:
+        json.dump(stats_summary(stats, class_names), f, ensure_ascii=False, indent=2)
+    return stats
+
+
+# 读取缓存的统计量
+def load_stats(pkl_path):
+    """
+    读取数据集的统计量缓存
+
+    缓存不存在，或比 pkl（及其追加分段）旧时重新计算并写回缓存
+    """
+    out_dir, file_name = os.path.split(pkl_path)
+    name = os.path.splitext(file_name)[0]
+    npz_path, json_path = stats_paths(out_dir, name)
+
+    sources = [pkl_path] + list_segments(pkl_path)
+    newest = max(os.path.getmtime(path) for path in sources if os.path.exists(path))
+    if os.path.exists(npz_path) and os.path.getmtime(npz_path) >= newest:
+        with np.load(npz_path) as f:
+            return {key: f[key] for key in f.files}
+
+    class_names = None
+    if os.path.exists(json_path):
+        with open(json_path, "r", encoding="utf-8") as f:
+            class_names = json.load(f).get("class_names")
+    return save_stats(load_dataset(pkl_path)["labels"], out_dir, name, class_names)
+
+
+# 打印统计结果
+def print_stats(stats, class_names=None):
+    summary = stats_summary(stats, class_names)
+    print(f"样本数={summary['num_samples']}, 类别数={summary['num_classes']}, "
+          f"平均标签数={summary['label_cardinality']:.3f}, 无标签样本={summary['empty_samples']}")
+    print("每个样本的标签数分布:", summary["cardinality_hist"])
+    print("\n===== 每个类别的图像数量 =====")
+    for class_name, num in summary["class_counts"].items():
+        print(f"{class_name:20s}: {num}")
+
+
+# 主程序入口
+if __name__ == "__main__":
+    import argparse  # 命令行参数解析库
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("pkl", type=str, help="已构建的pkl文件，如 pkl_dataset/coco2017.pkl")
+    args = parser.parse_args()
+
+    stats = load_stats(args.pkl)
+    out_dir, file_name = os.path.split(args.pkl)
+    json_path = stats_paths(out_dir, os.path.splitext(file_name)[0])[1]
+    with open(json_path, "r", encoding="utf-8") as f:
+        print_stats(stats, json.load(f)["class_names"])
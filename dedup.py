@@ -0,0 +1,193 @@
+# 基于文件内容哈希的重复图像去重（NUS-WIDE、MIRFlickr 中存在重复上传的 Flickr 图片）
+import os  # 操作系统接口
+import json  # JSON处理库
+import hashlib  # 哈希算法
+from concurrent.futures import ProcessPoolExecutor  # 进程池
+import numpy as np  # 数值计算库
+from dataset_io import add_output_args, load_dataset, save_dataset, take_rows  # 数据集读写
+from dataset_stats import save_stats  # 标签统计
+
+
+# 计算单个文件的内容哈希
+def file_digest(path: str, block_size: int = 1 << 20):
+    """分块读取文件计算 blake2b 哈希，返回 (path, 十六进制摘要)"""
+    h = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            h.update(block)
+    return path, h.hexdigest()
+
+
+# 读取哈希缓存
+def load_hash_cache(cache_path: str):
+    """
+    读取哈希缓存文件
+
+    返回:
+    cache: {图像路径: [文件大小, 修改时间(ns), 哈希]}
+    """
+    if cache_path and os.path.exists(cache_path):
+        with open(cache_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    return {}
+
+
+# 计算所有图像的内容哈希
+def hash_images(indexs: list, image_root: str, cache_path: str = None, workers: int = None):
+    """
+    计算数据集中图像的内容哈希
+
+    参数:
+    indexs: 图像路径列表（相对 image_root）
+    image_root: 图像根目录
+    cache_path: 哈希缓存文件，文件大小和修改时间未变的图像直接复用缓存
+    workers: 进程数，默认 CPU 核数
+
+    返回:
+    sizes: 每张图像的文件大小，int64数组，文件不存在为 -1
+    digests: 每张图像的哈希，大小唯一（不可能重复）或文件不存在的为 None
+
+    功能说明:
+    先按文件大小分桶，只有大小相同的文件才可能重复，只对这部分文件计算哈希；
+    需要计算的哈希在进程池中并行完成，结果写回缓存。
+    """
+    cache = load_hash_cache(cache_path)
+
+    # 1. 统计文件大小和修改时间
+    sizes = np.full(len(indexs), -1, dtype=np.int64)
+    mtimes = [0] * len(indexs)
+    for i, item in enumerate(indexs):
+        try:
+            stat = os.stat(os.path.join(image_root, item))
+        except OSError:
+            print(f"文件不存在: {item}")
+            continue
+        sizes[i] = stat.st_size
+        mtimes[i] = stat.st_mtime_ns
+
+    # 2. 按大小分桶，只保留大小出现不止一次的文件
+    _, inverse, counts = np.unique(sizes, return_inverse=True, return_counts=True)
+    need_hash = (counts[inverse] > 1) & (sizes >= 0)
+
+    # 3. 命中缓存的直接复用，其余并行计算
+    digests = [None] * len(indexs)
+    todo = {}
+    for i in np.flatnonzero(need_hash):
+        item = indexs[i]
+        cached = cache.get(item)
+        if cached is not None and cached[0] == int(sizes[i]) and cached[1] == mtimes[i]:
+            digests[i] = cached[2]
+        else:
+            todo[os.path.join(image_root, item)] = i
+    print(f"图像数量={len(indexs)}, 需要比较={int(need_hash.sum())}, 需要计算哈希={len(todo)}")
+
+    if todo:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            for path, digest in pool.map(file_digest, todo, chunksize=64):
+                i = todo[path]
+                digests[i] = digest
+                cache[indexs[i]] = [int(sizes[i]), mtimes[i], digest]
+
+        if cache_path:
+            with open(cache_path, "w", encoding="utf-8") as f:
+                json.dump(cache, f)
+
+    return sizes, digests
+
+
+# 按哈希分组
+def find_duplicates(sizes, digests):
+    """
+    找出内容完全相同的图像组
+
+    返回:
+    groups: [行号数组, ...]，每组至少两行，行号升序（第一行为保留行）
+    """
+    rows = np.array([i for i, d in enumerate(digests) if d is not None], dtype=np.int64)
+    if len(rows) == 0:
+        return []
+    keys = np.array([f"{sizes[i]}:{digests[i]}" for i in rows])
+    _, inverse, counts = np.unique(keys, return_inverse=True, return_counts=True)
+    dup = counts[inverse] > 1
+    rows, inverse = rows[dup], inverse[dup]
+    order = np.lexsort((rows, inverse))  # 先按组、组内按行号排序
+    rows, inverse = rows[order], inverse[order]
+    splits = np.flatnonzero(np.diff(inverse)) + 1
+    return np.split(rows, splits)
+
+
+# 合并两条描述
+def merge_captions(a, b):
+    """list 类型（COCO、MIRFlickr）合并去重；str 类型（NUS-WIDE 标签词）按词合并去重"""
+    if isinstance(a, str):
+        return " ".join(dict.fromkeys(a.split() + b.split()))
+    return list(dict.fromkeys(list(a) + list(b)))
+
+
+# 去重
+def dedup_dataset(data_dict: dict, groups: list, mode: str = "drop"):
+    """
+    去除重复图像
+
+    参数:
+    data_dict: 数据集字典
+    groups: find_duplicates 的结果
+    mode: "drop" 只保留每组第一行；"merge" 另外把组内其他行的标签（按位或）和描述合并到第一行
+
+    返回:
+    去重后的数据集字典，各列类型不变
+    """
+    n = len(data_dict["indexs"])
+    keep = np.ones(n, dtype=bool)
+    for group in groups:
+        keep[group[1:]] = False
+
+    if mode == "merge" and groups:
+        data_dict = dict(data_dict)
+        labels = np.array(data_dict["labels"])
+        captions = list(data_dict["captions"])
+        for group in groups:
+            labels[group[0]] = labels[group].max(axis=0)
+            for i in group[1:]:
+                captions[group[0]] = merge_captions(captions[group[0]], captions[i])
+        data_dict["labels"] = labels if isinstance(data_dict["labels"], np.ndarray) else list(labels)
+        data_dict["captions"] = captions
+
+    return take_rows(data_dict, np.flatnonzero(keep))
+
+
+# 主程序入口
+if __name__ == "__main__":
+    import argparse  # 命令行参数解析库
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("pkl", type=str, help="已构建的pkl文件，如 pkl_dataset/nuswide.pkl")
+    parser.add_argument("--image-root", required=True, type=str,
+                        help="图像根目录，indexs 中的路径相对该目录")
+    parser.add_argument("--mode", default="drop", choices=["drop", "merge"],
+                        help="drop：删除重复行；merge：合并重复行的标签和描述")
+    parser.add_argument("--workers", default=None, type=int, help="哈希计算进程数")
+    parser.add_argument("--cache", default=None, type=str,
+                        help="哈希缓存文件，默认与pkl同名的 _hashes.json")
+    parser.add_argument("--name", default=None, type=str,
+                        help="输出数据集名称，默认在原名称后加 _dedup")
+    add_output_args(parser)  # --format/--save-dir/--mat-dir/--mat-chunk
+    args = parser.parse_args()
+
+    base = os.path.splitext(args.pkl)[0]
+    cache_path = args.cache or base + "_hashes.json"
+
+    data_dict = load_dataset(args.pkl)
+    sizes, digests = hash_images(data_dict["indexs"], args.image_root, cache_path, args.workers)
+    groups = find_duplicates(sizes, digests)
+    print(f"重复组数={len(groups)}, 删除行数={sum(len(g) - 1 for g in groups)}")
+    for group in groups[0:3]:
+        print([data_dict["indexs"][i] for i in group])
+
+    data_dict = dedup_dataset(data_dict, groups, args.mode)
+    print(f"去重后图像数量={len(data_dict['indexs'])}")
+
+    name = args.name or os.path.basename(base) + "_dedup"
+    out_dir = save_dataset(data_dict, args, name)
+    save_stats(data_dict["labels"], out_dir, name)  # 标签统计缓存
+    print(f"finished!see {out_dir}")  # 完成提示
@@ -1,7 +1,12 @@
 # 导入必要的库
 import os  # 操作系统接口
-import pickle
+import json  # JSON处理库（子进程中也需要）
 import numpy as np  # 数值计算库
+from concurrent.futures import ProcessPoolExecutor  # 进程池
+from dataset_io import (add_output_args, save_dataset, append_segment, pack_strings, unpack_strings, check_dataset,
+                        load_ids, list_segments, IdIndex)  # 数据集保存/导出
+from dataset_stats import save_stats, print_stats, stats_paths  # 标签统计
+from checkpoint import add_checkpoint_args, BuildCheckpoint, run_stage  # 构建检查点
 
 # 将json标注文件的信息和ID进行映射
 def make_id_dict(jsonData: dict, location:str,id:str,contents:str):
@@ -23,23 +28,93 @@ def make_id_dict(jsonData: dict, location:str,id:str,contents:str):
     return id_dict  # 返回处理结果
 
 
+# 将json中的images列表转为按ID排序的数组
+def image_arrays(images: list):
+    ids = np.array([item["id"] for item in images], dtype=np.int64)
+    names = np.array([item["file_name"] for item in images])
+    order = np.argsort(ids, kind="stable")
+    return ids[order], names[order]
+
+
+# 检查两个标注文件中 图像ID -> 文件名 的对应关系
+def check_file_names(captionImages: list, instanceImages: list):
+    """
+    逐个图像比较描述文件和实例文件中的 id -> file_name（向量化），返回所有不一致信息的列表
+    【确保两个json文件的相同图像ID对应的是同一张图片】
+    """
+    errors = []
+    ids_a, names_a = image_arrays(captionImages)
+    ids_b, names_b = image_arrays(instanceImages)
+    for name, ids in [("描述文件", ids_a), ("类别文件", ids_b)]:
+        for img_id in ids[1:][ids[1:] == ids[:-1]]:
+            errors.append(f"{name}中图像ID重复: {img_id}")
+
+    common, ia, ib = np.intersect1d(ids_a, ids_b, assume_unique=False, return_indices=True)
+    for i in np.flatnonzero(names_a[ia] != names_b[ib]):
+        errors.append(f"不一致: id={common[i]}, 描述文件对应的图像文件名={names_a[ia[i]]}, 类别文件对应的图像文件名={names_b[ib[i]]}")
+    for img_id in np.setdiff1d(ids_a, ids_b):
+        errors.append(f"只在描述文件中的图像: id={img_id}")
+    for img_id in np.setdiff1d(ids_b, ids_a):
+        errors.append(f"只在类别文件中的图像: id={img_id}")
+    return errors
+
+
 # ============ 处理数据 ============
-def process(PATH,dataset):
+def process(PATH,dataset,checkpoint=None):
+    captionsFile = os.path.join(PATH, "annotations", f"captions_{dataset}2017.json")
+    instancesFile = os.path.join(PATH, "annotations", f"instances_{dataset}2017.json")
+    return process_files(captionsFile, instancesFile, f"{dataset}2017/", checkpoint, f"{dataset}_")
+
+
+# 处理一对COCO格式的标注文件（描述 + 实例），prefix 为图像路径前缀，如 "train2017/"
+def process_files(captionsFile, instancesFile, prefix, checkpoint=None, tag=""):
+    """
+    依次执行 parse -> group -> encode -> verify 四个阶段
+
+    返回:
+    indexList, captionList, categoryList, 图像ID列表, 类别名称列表（顺序与标签列一致）
+
+    参数:
+    checkpoint: BuildCheckpoint，为 None 时不保存中间结果
+    tag: 阶段名前缀，如 "train_"，区分不同子集的阶段
+    """
+    captionData, instanceData = run_stage(checkpoint, f"{tag}parse", parse_files, captionsFile, instancesFile)
+    grouped = run_stage(checkpoint, f"{tag}group", group_by_id, captionData, instanceData)
+    encoded = run_stage(checkpoint, f"{tag}encode", encode_rows, grouped, prefix)
+    run_stage(checkpoint, f"{tag}verify", verify_rows, captionData, instanceData, encoded, prefix)
+    class_names = [category["name"] for category in instanceData["categories"]]
+    return (*encoded, class_names)
+
+
+# ============ 阶段1 parse：读取JSON，只保留用到的字段 ============
+def parse_files(captionsFile, instancesFile):
     # 读取JSON标注文件
-    jsonFile = os.path.join(PATH, "annotations", f"captions_{dataset}2017.json")
+    jsonFile = captionsFile
     with open(jsonFile, "r") as f:
         jsonData = json.load(f)
-    # 创建ID-索引字典
-    indexDict = make_id_dict(jsonData, "images","id","file_name")
-    # 创建ID-描述字典
-    captionDict = make_id_dict(jsonData, "annotations","image_id","caption")
+    captionData = {"images": [{"id": item["id"], "file_name": item["file_name"]} for item in jsonData["images"]],
+                   "annotations": [{"image_id": item["image_id"], "caption": item["caption"]}
+                                   for item in jsonData["annotations"]]}
 
-    # 读取JSON标注文件
-    jsonFile = os.path.join(PATH, "annotations", f"instances_{dataset}2017.json")
+    # 读取JSON标注文件（实例标注中的分割多边形等字段用不上，不保留）
+    jsonFile = instancesFile
     with open(jsonFile, "r") as f:
         jsonData = json.load(f)
+    instanceData = {"images": [{"id": item["id"], "file_name": item["file_name"]} for item in jsonData["images"]],
+                    "annotations": [{"image_id": item["image_id"], "category_id": item["category_id"]}
+                                    for item in jsonData["annotations"]],
+                    "categories": [{"id": item["id"], "name": item["name"]} for item in jsonData["categories"]]}
+    return captionData, instanceData
+
+
+# ============ 阶段2 group：按图像ID分组并对齐 ============
+def group_by_id(captionData, instanceData):
+    # 创建ID-索引字典
+    indexDict = make_id_dict(captionData, "images","id","file_name")
+    # 创建ID-描述字典
+    captionDict = make_id_dict(captionData, "annotations","image_id","caption")
     # 创建ID-类别字典
-    categoryDict = make_id_dict(jsonData, "annotations","image_id","category_id")
+    categoryDict = make_id_dict(instanceData, "annotations","image_id","category_id")
 
     # ============ 找出共有的ID（确保数据对齐） ============
     # 获取三个字典中都存在的图像ID
@@ -53,26 +128,26 @@ def process(PATH,dataset):
     captionDict = {img_id: captionDict[img_id] for img_id in common_ids}
     categoryDict = {img_id: categoryDict[img_id] for img_id in common_ids}
 
-    # ============ 将ID-类别字典转为ID-独热编码字典 ============
-    # 读取JSON标注文件
-    jsonFile = os.path.join(PATH, "annotations", f"instances_{dataset}2017.json")
-    with open(jsonFile, "r") as f:
-        jsonData = json.load(f)
     # 创建类别ID-类别索引字典【1~90=>0~类别长度】
     reflectDict = {}
-    for i,category in enumerate(jsonData["categories"]):
+    for i,category in enumerate(instanceData["categories"]):
         reflectDict[category["id"]] = i
 
-    # ============ 按ID排序并存储为列表 ============
+    # 将ID转换为整数排序，确保一致的顺序
+    sorted_ids = sorted(common_ids, key=lambda x: int(x) if str(x).isdigit() else x)
+    return indexDict, captionDict, categoryDict, reflectDict, sorted_ids
+
+
+# ============ 阶段3 encode：按ID排序并存储为列表，类别转为独热编码 ============
+def encode_rows(grouped, prefix):
+    indexDict, captionDict, categoryDict, reflectDict, sorted_ids = grouped
     indexList = []
     captionList = []
     categoryList = []
-    # 将ID转换为整数排序，确保一致的顺序
-    sorted_ids = sorted(common_ids, key=lambda x: int(x) if str(x).isdigit() else x)
     # 创建索引、描述和类别的列表
     for id in sorted_ids:
         # 获取索引
-        indexList.append(f"{dataset}2017/"+indexDict[id][0])
+        indexList.append(prefix+indexDict[id][0])
         # 获取描述
         captionList.append(captionDict[id])
         # 获取类别【类别ID列表转为多标签独热编码】
@@ -81,25 +156,170 @@ def process(PATH,dataset):
             code[reflectDict[category]] = 1
         categoryList.append(code)
 
-    return indexList, captionList, categoryList
+    # 图像ID（已排序）也保留下来，用于按ID查找行号
+    return indexList, captionList, categoryList, sorted_ids
+
+
+# ============ 阶段4 verify：逐行校验（确保索引一致） ============
+def verify_rows(captionData, instanceData, encoded, prefix):
+    indexList, captionList, categoryList, sorted_ids = encoded
+    # 两个json文件的 id -> file_name 全部核对，再用类别文件的文件名逐行核对图像路径
+    errors = check_file_names(captionData["images"], instanceData["images"])
+    ids_b, names_b = image_arrays(instanceData["images"])
+    ids = np.array(sorted_ids, dtype=np.int64)
+    expected = None
+    if len(ids_b):
+        # 每行图像ID在类别文件中对应的文件名（类别文件中没有的ID已在 check_file_names 中报告）
+        pos = np.minimum(np.searchsorted(ids_b, ids), len(ids_b) - 1)
+        expected = [prefix + name for name in names_b[pos].tolist()]
+    check_dataset({"indexs": indexList, "captions": captionList, "labels": categoryList, "ids": ids},
+                  expected, errors)
+
+
+# 把新增数据的标签列对齐到已有数据集的类别顺序
+def align_categories(categoryList, class_names, base_names):
+    """
+    新增数据的标签列按它自己的实例文件中 categories 的顺序排列，
+    按类别名称重新排列为已有数据集的列顺序（base_names），返回新的标签列表
+
+    新增数据中有已有数据集没有的类别时抛出 ValueError；新增数据只列出部分类别时，其余列为0
+    """
+    unknown = [name for name in class_names if name not in base_names]
+    if unknown:
+        raise ValueError(f"新增数据的类别不在已有数据集中: {unknown}，已有类别: {base_names}")
+    columns = [base_names.index(name) for name in class_names]
+    labels = np.zeros((len(categoryList), len(base_names)), dtype=np.int8)
+    if categoryList:
+        labels[:, columns] = np.stack(categoryList)
+    return list(labels)
+
+
+# 在子进程中处理一个子集，结果转为紧凑数组返回
+def process_arrays(PATH, dataset, checkpoint=None):
+    """
+    在子进程中调用 process(PATH, dataset, checkpoint)，把结果转为紧凑数组再传回主进程
+
+    返回:
+    index_blob, index_offsets: 图像路径（pack_strings 编码）
+    caption_blob, caption_offsets: 全部描述按图像顺序展平（pack_strings 编码）
+    caption_counts: 每张图像的描述条数，int32数组
+    labels: 标签矩阵，int8 [图像数量, 类别数]
+    ids: COCO图像ID，int64数组
+    class_names: 类别名称列表
+    """
+    indexList, captionList, categoryList, idList, class_names = process(PATH, dataset, checkpoint)
+    index_blob, index_offsets = pack_strings(indexList)
+    caption_blob, caption_offsets = pack_strings([caption for captions in captionList for caption in captions])
+    caption_counts = np.array([len(captions) for captions in captionList], dtype=np.int32)
+    labels = np.stack(categoryList) if categoryList else np.zeros((0, 0), dtype=np.int8)
+    ids = np.array(idList, dtype=np.int64)
+    return index_blob, index_offsets, caption_blob, caption_offsets, caption_counts, labels, ids, class_names
+
+
+# 并行处理多个子集，按给定顺序合并
+def process_concurrent(PATH, datasets, checkpoint=None):
+    """
+    每个子集（train、val）在单独的进程中解析JSON和分组，结果按 datasets 的顺序
+    写入预先分配好的列表和标签矩阵，顺序与依次调用 process 再 extend 完全一致
+
+    返回:
+    indexList, captionList（与 process 相同），标签矩阵 labels，
+    COCO图像ID ids，所属子集 splits（datasets 中的位置，train=0、val=1），以及类别名称 class_names
+    """
+    with ProcessPoolExecutor(max_workers=len(datasets)) as pool:
+        results = list(pool.map(process_arrays, [PATH] * len(datasets), datasets,
+                                [checkpoint] * len(datasets)))
+
+    # 预分配输出
+    sizes = [len(result[4]) for result in results]
+    total = sum(sizes)
+    num_classes = max(result[5].shape[1] for result in results)
+    class_names = max((result[7] for result in results), key=len)
+    labels = np.zeros((total, num_classes), dtype=np.int8)
+    ids = np.zeros(total, dtype=np.int64)
+    splits = np.zeros(total, dtype=np.int8)
+    indexList = [None] * total
+    captionList = [None] * total
+
+    start = 0
+    for split, (dataset, size, result) in enumerate(zip(datasets, sizes, results)):
+        index_blob, index_offsets, caption_blob, caption_offsets, caption_counts, part_labels, part_ids, _ = result
+        end = start + size
+        indexList[start:end] = unpack_strings(index_blob, index_offsets)
+        captions = unpack_strings(caption_blob, caption_offsets)
+        bounds = np.zeros(size + 1, dtype=np.int64)
+        np.cumsum(caption_counts, out=bounds[1:])
+        captionList[start:end] = [captions[s:e] for s, e in zip(bounds[:-1].tolist(), bounds[1:].tolist())]
+        labels[start:end, :part_labels.shape[1]] = part_labels
+        ids[start:end] = part_ids
+        splits[start:end] = split
+        print(f"{dataset}数据集大小: 图像数量={size}, 描述数量={len(captions)}, 类别={part_labels.shape[1]}")
+        start = end
+
+    return indexList, captionList, labels, ids, splits, class_names
+
 
 # 主程序入口
 if __name__ == "__main__":
-    import json  # JSON处理库
-    import scipy.io as scio  # MATLAB文件读写库
     import argparse  # 命令行参数解析库
 
     # 创建命令行参数解析器.在字符串前加 r 表示原始字符串
     parser = argparse.ArgumentParser()
     parser.add_argument("--coco-dir", default=r"D:\BaiduNetdiskDownload\clip-hash-dataset.tar\clip-hash-dataset\baidu-clip-hash-dataset\coco\coco2017", type=str,
                         help="COCO数据集目录路径")
-    parser.add_argument("--save-dir", default="./pkl_dataset", type=str,
-                        help="PKL文件保存目录")
+    parser.add_argument("--append-captions", default=None, type=str,
+                        help="只包含新增图像的描述JSON文件（COCO格式），指定后只追加新增数据，不重新构建")
+    parser.add_argument("--append-instances", default=None, type=str,
+                        help="只包含新增图像的实例JSON文件（COCO格式）")
+    parser.add_argument("--append-prefix", default="train2017/", type=str,
+                        help="新增图像的路径前缀")
+    parser.add_argument("--append-split", default=0, type=int,
+                        help="新增图像所属子集（0=train，1=val）")
+    add_output_args(parser)  # --format/--save-dir/--mat-dir/--mat-chunk
+    add_checkpoint_args(parser, "coco2017")  # --resume/--scratch-dir
     args = parser.parse_args()  # 解析命令行参数
 
     # 设置路径
     PATH = args.coco_dir  # COCO数据集根目录
 
+    # ============ 追加模式：只处理新增的图像，写为一个新的分段 ============
+    # 读取时 dataset_io.load_dataset 会把分段拼接在主文件之后，
+    # 定期用 python dataset_io.py compact pkl_dataset/coco2017.pkl 合并分段
+    if args.append_captions or args.append_instances:
+        if not (args.append_captions and args.append_instances):
+            parser.error("--append-captions 和 --append-instances 需要同时指定")
+        indexList, captionList, categoryList, idList, class_names = process_files(args.append_captions,
+                                                                                  args.append_instances,
+                                                                                  args.append_prefix)
+        # 标签列按已有数据集的类别名称（coco2017_stats.json 中的 class_names）对齐
+        pkl_path = os.path.join(args.save_dir, "coco2017.pkl")
+        stats_json = stats_paths(args.save_dir, "coco2017")[1]
+        if os.path.exists(stats_json):
+            with open(stats_json, "r", encoding="utf-8") as f:
+                categoryList = align_categories(categoryList, class_names, json.load(f)["class_names"])
+        elif os.path.exists(pkl_path) or list_segments(pkl_path):
+            raise FileNotFoundError(f"找不到 {stats_json}，无法确认已有数据集的类别顺序，请用新版 make_coco.py 重新构建")
+        data_dict = {"indexs": indexList,  # 图片索引
+                     "captions": captionList,  # 文本描述
+                     "labels": categoryList,  # 标签矩阵
+                     "ids": np.array(idList, dtype=np.int64),  # COCO图像ID
+                     "splits": np.full(len(idList), args.append_split, dtype=np.int8)}  # 所属子集
+        # 新增图像ID不能已经存在：只读取已有数据（主文件和之前的分段）的 ids/splits 旁路文件，
+        # 不读取整个数据集；行顺序只在新分段内部检查
+        existing = load_ids(pkl_path)
+        errors = []
+        if existing is None:
+            print("warning: 已有数据没有 ids 列，无法检查图像ID是否重复")
+        elif len(existing["ids"]):
+            rows = IdIndex(existing).rows_for_ids(data_dict["ids"])
+            for img_id, row in zip(data_dict["ids"][rows >= 0].tolist(), rows[rows >= 0].tolist()):
+                errors.append(f"图像ID已存在: id={img_id}, 行={row}")
+        check_dataset(data_dict, errors=errors)
+        segment = append_segment(data_dict, pkl_path)
+        print(f"追加图像数量={len(indexList)}, 描述数量={sum(len(sublist) for sublist in captionList)}")
+        print(f"finished!see {segment}")
+        exit()
+
     # 可以验证，ID和文件名是一一对应的，139==>000000000139.jpg
     # jsonFile = os.path.join(PATH, "annotations", f"captions_train2017.json")
     # with open(jsonFile, "r") as f:
@@ -112,16 +332,20 @@ if __name__ == "__main__":
     # exit()
     
 
-    indexList,captionList,categoryList = process(PATH, "train")
-    print(f"val数据集大小: 图像数量={len(indexList)}, 描述数量={sum(len(sublist) for sublist in captionList)}, 类别={len(categoryList[0])}")
+    # ============ 构建检查点 ============
+    # 每个子集 parse -> group -> encode -> verify（train、val 两条分支同时执行），合并后 merge -> verify -> write，
+    # 每个阶段完成后保存结果，中断后用 --resume 从每条分支第一个未完成的阶段继续
+    datasets = ["train", "val"]
+    branches = [[f"{dataset}_{stage}" for stage in ["parse", "group", "encode", "verify"]] for dataset in datasets]
+    config = {key: value for key, value in vars(args).items() if key not in ("resume", "scratch_dir")}
+    checkpoint = BuildCheckpoint(args.scratch_dir, [branches, "merge", "verify", "write"], args.resume, config)
+
+    # train、val 在两个子进程中同时处理，验证集数据按顺序追加在训练集数据后面
+    indexList, captionList, labels, ids, splits, class_names = checkpoint.stage("merge", process_concurrent, PATH, datasets, checkpoint)
+    categoryList = list(labels)  # 与 process 的输出格式一致：每行一个int8数组
     print(indexList[0:2])
     print(captionList[0:2])
     print(categoryList[0:2])
-    indexList1, captionList1, categoryList1 = process(PATH, "val")
-    # 将验证集数据追加到训练集数据后面
-    indexList.extend(indexList1)  # 合并图像文件名
-    captionList.extend(captionList1)  # 合并描述
-    categoryList.extend(categoryList1)  # 合并类别标签
 
     print(f"最终数据集大小: 图像数量={len(indexList)}, 描述数量={sum(len(sublist) for sublist in captionList)}, 类别={len(categoryList[0])}")
 
@@ -132,21 +356,18 @@ if __name__ == "__main__":
     # 准备保存的数据结构
     data_dict = {"indexs": indexList,  # 图片索引
                  "captions": captionList,  # 文本描述
-                 "labels": categoryList}  # 标签矩阵
-
-    # 保存为.pkl文件（pikle格式）
-    # ============ 创建 mat 目录（如果不存在） ============
-    pkl_dir = "pkl_dataset"
-    os.makedirs(pkl_dir, exist_ok=True)
+                 "labels": categoryList,  # 标签矩阵
+                 "ids": ids,  # COCO图像ID
+                 "splits": splits}  # 所属子集：0=train2017，1=val2017
+    checkpoint.stage("verify", check_dataset, data_dict)  # 合并后再校验一次列长度和 train->val 的行顺序
 
-    #  保存为pickle格式（Python原生，加载最快）
-    # "wb"参数：w=写入模式，b=二进制模式（pickle需要二进制）
-    # pickle.dump()函数：将Python对象序列化并写入文件
-    # 函数语法：pickle.dump(要保存的对象, 文件对象, 协议版本)
-    with open(os.path.join(pkl_dir, "coco2017.pkl"), "wb") as f:
-        pickle.dump(data_dict, f)
+    # 保存为.pkl文件（pikle格式），--format mat 时导出为mat文件
+    out_dir = checkpoint.stage("write", save_dataset, data_dict, args, "coco2017")
+    # 标签统计（类别频数、共现矩阵、标签数分布），缓存为 coco2017_stats.npz / .json
+    print_stats(save_stats(labels, out_dir, "coco2017", class_names), class_names)
+    checkpoint.finish()
 
-    print(f"finished!see {pkl_dir}")  # 完成提示
+    print(f"finished!see {out_dir}")  # 完成提示
 
 # D:\Anaconda3\envs\study\pythonw.exe C:/Users/dy/Desktop/CMR_BASE/dataset/make_minicoco.py
 # index:118287、caption:118287、category:117266,有117266个完整样本
@@ -0,0 +1,157 @@
+# 从已构建的数据集中抽取小规模子集（如 minicoco2017.pkl），保持各类别比例
+import os  # 操作系统接口
+import numpy as np  # 数值计算库
+from dataset_io import add_output_args, load_dataset, save_dataset, take_rows  # 数据集读写
+from dataset_stats import save_stats  # 标签统计
+
+
+# 多标签迭代分层抽样
+def stratified_subset(labels, size: int, seed: int = 0):
+    """
+    在标签矩阵上做多标签迭代分层抽样（iterative stratification），返回子集行号
+
+    参数:
+    labels: 标签矩阵 [样本数, 类别数]，0/1
+    size: 子集大小
+    seed: 随机种子，相同输入和种子得到相同子集
+
+    返回:
+    rows: 升序排列的子集行号（保持原数据集的顺序）
+
+    功能说明:
+    把数据集分为两份：子集（size 行）和其余部分，记录每一份每个类别还需要的样本数
+    （总数*比例）和还能容纳的行数。每轮选出“剩余未分配样本最少”的类别，先满足稀有类别，
+    把含该类别的未分配样本逐个分给对它的所有类别相对需求更大的一份
+    （相同时分给剩余容量比例大的一份），并扣减这一份对这些类别的需求；
+    某一份容量用完后只能分给另一份，因此子集大小严格等于 size。
+    没有标签的样本最后按剩余容量随机分配，最后用 rebalance_subset 修正剩余的比例偏差。
+    """
+    labels = np.asarray(labels).astype(bool)
+    n, num_classes = labels.shape
+    size = min(int(size), n)
+    rng = np.random.default_rng(seed)
+
+    counts = labels.sum(axis=0)
+    # 第0份为子集，第1份为其余部分
+    desired = np.stack([counts * (size / n), counts * ((n - size) / n)])  # 每一份每个类别期望的样本数
+    need = desired.copy()  # 每一份每个类别还需要的样本数
+    capacity = np.array([size, n - size])  # 每一份还能容纳的行数
+    remaining = counts.astype(np.int64)  # 每个类别剩余未分配的样本数
+    fold = np.full(n, -1, dtype=np.int8)  # 每行分到哪一份，-1 为未分配
+    row_labels = [np.flatnonzero(row) for row in labels]  # 每行的类别
+
+    while remaining.any():
+        # 剩余样本最少的类别，同数随机
+        rarest = remaining[remaining > 0].min()
+        cls = rng.choice(np.flatnonzero(remaining == rarest))
+
+        rows = np.flatnonzero(labels[:, cls] & (fold < 0))
+        rng.shuffle(rows)
+        for i in rows.tolist():
+            cols = row_labels[i]
+            if capacity[0] == 0 or capacity[1] == 0:
+                f = 0 if capacity[1] == 0 else 1
+            else:
+                # 两份对该样本所有类别的相对需求（还需要的数量 / 期望数量）
+                demand = (need[:, cols] / np.maximum(desired[:, cols], 1e-12)).sum(axis=1)
+                if demand[0] != demand[1]:
+                    f = 0 if demand[0] > demand[1] else 1
+                else:
+                    f = 0 if capacity[0] * (n - size) >= capacity[1] * size else 1
+            fold[i] = f
+            need[f, cols] -= 1
+            capacity[f] -= 1
+            remaining[cols] -= 1
+
+    # 没有标签的样本按剩余容量随机分配
+    rows = np.flatnonzero(fold < 0)
+    rng.shuffle(rows)
+    fold[rows[:capacity[0]]] = 0
+    return rebalance_subset(labels, np.flatnonzero(fold == 0))
+
+
+# 交换样本修正类别比例
+def rebalance_subset(labels, rows, max_swaps: int = None):
+    """
+    每次把子集中的一行换成子集外的一行，使子集的类别数量更接近期望值，直到无法再改善
+
+    参数:
+    labels: 标签矩阵 [样本数, 类别数]，0/1
+    rows: 子集行号
+    max_swaps: 最多交换次数，默认为子集大小
+
+    返回:
+    rows: 升序排列的子集行号，大小不变
+
+    功能说明:
+    目标为 sum((子集中类别数量 - 期望数量)^2 / max(期望数量, 1))，
+    先选移出后目标下降最多的行，再选移入后目标下降最多的行，两步合计下降时才交换。
+    迭代分层抽样先按类别逐个分配，各类别共现时前面的分配会影响后面的类别，
+    这一步修正由此产生的偏差，结果不会比交换前更差。
+    """
+    labels = np.asarray(labels).astype(bool)
+    n = len(labels)
+    packed = labels.astype(np.float32)
+    selected = np.zeros(n, dtype=bool)
+    selected[rows] = True
+    desired = labels.sum(axis=0) * (int(selected.sum()) / n)
+    weight = 1 / np.maximum(desired, 1)
+    diff = labels[selected].sum(axis=0) - desired  # 子集中每个类别的数量 - 期望数量
+    if selected.all() or not selected.any():
+        return np.flatnonzero(selected)
+
+    for _ in range(int(selected.sum()) if max_swaps is None else max_swaps):
+        inside = np.flatnonzero(selected)
+        # 移出第 r 行目标的下降量 = sum(w * l_r * (2d - 1))
+        remove_gain = packed[inside] @ (weight * (2 * diff - 1)).astype(np.float32)
+        out_row = inside[np.argmax(remove_gain)]
+        diff_after = diff - labels[out_row]
+        # 移入第 a 行目标的下降量 = -sum(w * l_a * (2d + 1))
+        add_gain = -(packed @ (weight * (2 * diff_after + 1)).astype(np.float32))
+        add_gain[selected] = -np.inf
+        in_row = int(np.argmax(add_gain))
+        if remove_gain.max() + add_gain[in_row] <= 1e-6:
+            break
+        selected[out_row] = False
+        selected[in_row] = True
+        diff = diff_after + labels[in_row]
+
+    return np.flatnonzero(selected)
+
+
+# 主程序入口
+if __name__ == "__main__":
+    import argparse  # 命令行参数解析库
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("pkl", type=str, help="已构建的pkl文件，如 pkl_dataset/coco2017.pkl")
+    parser.add_argument("--size", default=2000, type=int, help="子集大小")
+    parser.add_argument("--seed", default=0, type=int, help="随机种子")
+    parser.add_argument("--name", default=None, type=str,
+                        help="输出数据集名称，默认在原名称前加 mini，如 minicoco2017")
+    add_output_args(parser)  # --format/--save-dir/--mat-dir/--mat-chunk
+    args = parser.parse_args()
+
+    data_dict = load_dataset(args.pkl)
+    labels = np.asarray(data_dict["labels"])
+    rows = stratified_subset(labels, args.size, args.seed)
+    subset = take_rows(data_dict, rows)
+
+    # ============ 对比子集和原数据集的类别比例 ============
+    full_ratio = labels.sum(axis=0) / len(labels)
+    sub_ratio = labels[rows].sum(axis=0) / max(len(rows), 1)
+    print(f"原数据集大小: {len(labels)}, 子集大小: {len(rows)}")
+    # 与同样大小的随机抽样对比，分层抽样的偏差不应更大
+    random_rows = np.random.default_rng(args.seed).choice(len(labels), len(rows), replace=False)
+    random_ratio = labels[random_rows].sum(axis=0) / max(len(rows), 1)
+    deviation = np.abs(full_ratio - sub_ratio).max()
+    random_deviation = np.abs(full_ratio - random_ratio).max()
+    print(f"类别比例最大偏差: {deviation:.4f}（随机抽样: {random_deviation:.4f}）")
+    if deviation > random_deviation:
+        print("warning: 分层抽样的类别比例偏差大于随机抽样")
+    print(f"子集中缺失的类别数: {int(((labels.sum(axis=0) > 0) & (labels[rows].sum(axis=0) == 0)).sum())}")
+
+    name = args.name or "mini" + os.path.splitext(os.path.basename(args.pkl))[0]
+    out_dir = save_dataset(subset, args, name)
+    save_stats(subset["labels"], out_dir, name)  # 标签统计缓存
+    print(f"finished!see {out_dir}")  # 完成提示
@@ -1,8 +1,22 @@
 import os # 导入操作系统接口模块，用于处理文件和目录路径
 import numpy as np # 导入NumPy库，用于数值计算和数组操作
-import pickle # 导入pickle模块 - Python内置的序列化模块
+import argparse  # 命令行参数解析库
+from dataset_io import add_output_args, save_dataset, check_dataset  # 数据集保存/导出
+from dataset_stats import save_stats, print_stats  # 标签统计
+from checkpoint import add_checkpoint_args, BuildCheckpoint  # 构建检查点
 # 数据预处理脚本：将MIRFlickr-25K数据集转换为pkl格式
 
+# 命令行参数：输出格式/目录（--format mat 导出为mat文件），--resume 从中断处继续
+parser = argparse.ArgumentParser()
+add_output_args(parser)
+add_checkpoint_args(parser, "flickr25k")
+args = parser.parse_args()
+
+# 构建检查点：parse_labels -> parse_captions -> encode -> verify -> write，每个阶段完成后保存结果
+config = {key: value for key, value in vars(args).items() if key not in ("resume", "scratch_dir")}
+checkpoint = BuildCheckpoint(args.scratch_dir, ["parse_labels", "parse_captions", "encode", "verify", "write"],
+                             args.resume, config)
+
 # 设置数据集根目录，需要替换为实际下载目录
 root_dir = "raw_dataset/mirflickr25k"
 
@@ -11,7 +25,8 @@ root_dir = "raw_dataset/mirflickr25k"
 file_path = os.path.join(root_dir, "mirflickr25k_annotations_v080")
 
 # 获取标签目录下的所有文件列表
-file_list = os.listdir(file_path)
+# 按文件名排序，类别顺序不再依赖 os.listdir 的返回顺序
+file_list = sorted(os.listdir(file_path))
 
 # 过滤文件列表，移除包含"_r1"的文件和README文件
 # "_r1"可能是重复文件，README是说明文件
@@ -20,119 +35,118 @@ file_list = [item for item in file_list if "_r1" not in item and "README" not in
 # 打印类别数量（每个文件对应一个类别）
 print("class num:", len(file_list))
 
-# 创建类别索引字典：类别文件名 -> 索引编号
-class_index = {}
-# enumerate返回(索引, 元素)对，i从0开始递增
-for i, item in enumerate(file_list):
-    class_index.update({item: i})  # 将类别文件名映射到数字索引
-
-
-# 创建标签字典：{图像ID : 多标签向量}【不是所有图片都在给定类别当中】
-label_dict = {}
-# 遍历每个类别文件
-for path_id in file_list:
-    # 构建完整的文件路径
-    path = os.path.join(file_path, path_id)
-    # 打开类别文件读取
-    with open(path, "r") as f:
-        # 逐行读取文件内容
-        for item in f:
-            item = item.strip()  # 移除字符串两端的空白字符
-            # 将读取的字符串转为int
-            item = int(item)
-            # 如果图像ID不在字典中，创建新的标签向量
-            if item not in label_dict:
-                # 创建全零向量，长度为类别总数
-                label = np.zeros(len(file_list),dtype=np.int8)
-                # 将当前类别对应的位置设为1（one-hot编码）
-                label[class_index[path_id]] = 1
-                # 添加到字典：图像ID -> 标签向量
-                label_dict.update({item: label})
-            else:
-                # 如果图像ID已存在，更新对应类别的标签为1
-                # 说明该图像属于多个类别（多标签）
-                label_dict[item][class_index[path_id]] = 1
-
-# 打印至少有一个类别的图像数量
-print("sample size:", len(label_dict))
-# 打印丢弃的样本
-miss = set(range(1,25001)) - set(label_dict.keys())
-print("miss",len(miss))
-print(f"miss {sorted(list(miss))[0:3]} ...")
-
-# 获取所有图像ID并排序，确保顺序一致
-keys = list(label_dict.keys())
-keys.sort()  # 按数字顺序排序
-
-
-# 创建标签矩阵：按排序后的图像ID顺序提取标签向量
-labels = []
-for key in keys:
-    labels.append(label_dict[key])  # 添加对应图像的标签向量
-print("labels created:", len(labels))
-
-# 构建图像文件路径列表
-PATH = "mirflickr/"
-# 为每个图像ID构建完整的.jpg文件路径
-# 图像命名格式：im{图像ID}.jpg
-indexs = [PATH + "im" + str(item) + ".jpg" for item in keys]
-print("index created:", len(indexs))
-
-
-# 处理文本描述（captions）
-captions_path = os.path.join(root_dir, "mirflickr/meta/tags")
-# 获取所有标签文件（每个图像对应一个标签文件）
-captions_list = os.listdir(captions_path)
-# 创建描述字典：图像ID -> 文本描述
-captions_dict = {}
-# 遍历每个标签文件
-for item in captions_list:
-    # 从文件名提取图像ID：tags12345.txt -> 12345
-    id_ = item.split(".")[0].replace("tags", "")
-    id_ = int(id_)
-    caption = ""  # 初始化空描述字符串
-    # 打开文件读取内容
-    with open(os.path.join(captions_path, item), "r",encoding="utf-8") as f:
-        # 读取所有行，每行是一个标签词
-        for word in f.readlines():
-            caption += word.strip() + " "  # 将标签词用空格连接
-    caption = caption.strip()  # 移除首尾空格
-    # 添加到字典：图像ID -> 文本描述
-    captions_dict.update({id_: caption})
-
-# 创建描述列表：按排序后的图像ID顺序提取描述
-captions = []
-for item in keys:
-    # 每个描述包装成列表
-    captions.append([captions_dict[item]])
-
-print("captions created:", len(captions))
-
-
-# ============ 保存为pkl格式文件 ============
-# 把Python对象（如列表、字典、numpy数组等）转换成二进制格式并保存到文件中。
-# 准备保存的数据结构
-data_dict = {"indexs": indexs, # 图片索引
-               "captions": captions, # 文本描述
-               "labels": labels}  # 标签矩阵
-
-
-# 保存为.pkl文件（pikle格式）
-# ============ 创建 mat 目录（如果不存在） ============
-pkl_dir = "pkl_dataset"
-os.makedirs(pkl_dir, exist_ok=True)
-
-#  保存为pickle格式（Python原生，加载最快）
-# "wb"参数：w=写入模式，b=二进制模式（pickle需要二进制）
-# pickle.dump()函数：将Python对象序列化并写入文件
-# 函数语法：pickle.dump(要保存的对象, 文件对象, 协议版本)
-with open(os.path.join(pkl_dir, "flickr25k.pkl"), "wb") as f:
-    pickle.dump(data_dict, f)
-
-
-print(f"finished!see {pkl_dir}")  # 完成提示
-
-
-
-
 
+# 数据集共25000张图像，ID为1~25000
+NUM_IMAGES = 25000
+
+
+# ============ 阶段 parse_labels：读取类别文件 ============
+def parse_labels():
+    # 创建标签矩阵：第 i 行对应图像ID i+1【不是所有图片都在给定类别当中】
+    label_matrix = np.zeros((NUM_IMAGES, len(file_list)), dtype=np.int8)
+    errors = []  # 超出范围的图像ID
+    # 遍历每个类别文件
+    for i, path_id in enumerate(file_list):
+        # 构建完整的文件路径
+        path = os.path.join(file_path, path_id)
+        # 一次读入整个类别文件，转为图像ID数组（每行一个ID）
+        with open(path, "r") as f:
+            ids = np.array(f.read().split(), dtype=np.int64)
+        # 图像ID必须在 1~25000 之间，否则 ids - 1 会越界或回绕到矩阵末尾的行
+        valid = (ids >= 1) & (ids <= NUM_IMAGES)
+        for img_id in ids[~valid].tolist():
+            errors.append(f"图像ID超出范围 1~{NUM_IMAGES}: {path_id}, id={img_id}")
+        # 将这些图像在当前类别对应的位置设为1（多标签独热编码）
+        label_matrix[ids[valid] - 1, i] = 1
+
+    for error in errors:
+        print(error)
+    if errors:
+        raise ValueError(f"类别文件校验失败，共{len(errors)}处问题")
+    return label_matrix
+
+
+# ============ 阶段 parse_captions：读取文本描述（captions） ============
+def parse_captions():
+    captions_path = os.path.join(root_dir, "mirflickr/meta/tags")
+    # 获取所有标签文件（每个图像对应一个标签文件）
+    captions_list = os.listdir(captions_path)
+    # 创建描述字典：图像ID -> 文本描述
+    captions_dict = {}
+    # 遍历每个标签文件
+    for item in captions_list:
+        # 从文件名提取图像ID：tags12345.txt -> 12345
+        id_ = item.split(".")[0].replace("tags", "")
+        id_ = int(id_)
+        caption = ""  # 初始化空描述字符串
+        # 打开文件读取内容
+        with open(os.path.join(captions_path, item), "r",encoding="utf-8") as f:
+            # 读取所有行，每行是一个标签词
+            for word in f.readlines():
+                caption += word.strip() + " "  # 将标签词用空格连接
+        caption = caption.strip()  # 移除首尾空格
+        # 添加到字典：图像ID -> 文本描述
+        captions_dict.update({id_: caption})
+    return captions_dict
+
+
+# ============ 阶段 encode：过滤无标签图像，按图像ID顺序生成各列 ============
+def encode(label_matrix, captions_dict):
+    # 只保留至少有一个类别的图像
+    valid_mask = label_matrix.any(axis=1)
+    keys = np.flatnonzero(valid_mask) + 1  # 图像ID，升序
+    labels = label_matrix[valid_mask]
+
+    # 打印至少有一个类别的图像数量
+    print("sample size:", len(keys))
+    # 打印丢弃的样本
+    miss = np.setdiff1d(np.arange(1, NUM_IMAGES + 1), keys)
+    print("miss",len(miss))
+    print(f"miss {miss[0:3].tolist()} ...")
+
+    print("labels created:", len(labels))
+
+    # 构建图像文件路径列表
+    PATH = "mirflickr/"
+    # 为每个图像ID构建完整的.jpg文件路径
+    # 图像命名格式：im{图像ID}.jpg
+    indexs = [PATH + "im" + str(item) + ".jpg" for item in keys.tolist()]
+    print("index created:", len(indexs))
+
+    # 创建描述列表：按排序后的图像ID顺序提取描述
+    captions = []
+    for item in keys.tolist():
+        # 每个描述包装成列表
+        captions.append([captions_dict[item]])
+
+    print("captions created:", len(captions))
+
+    # ============ 保存为pkl格式文件 ============
+    # 把Python对象（如列表、字典、numpy数组等）转换成二进制格式并保存到文件中。
+    # 准备保存的数据结构
+    data_dict = {"indexs": indexs, # 图片索引
+                   "captions": captions, # 文本描述
+                   "labels": list(labels),  # 标签矩阵（与其他数据集的 pkl 格式一致：每行一个int8数组）
+                   "ids": keys,  # 图像ID：im{ID}.jpg
+                   "splits": np.zeros(len(keys), dtype=np.int8)}  # 所属子集（全部为0）
+    return data_dict, labels
+
+
+# 依次执行各阶段，已完成的阶段在 --resume 时直接读取保存的结果
+label_matrix = checkpoint.stage("parse_labels", parse_labels)
+captions_dict = checkpoint.stage("parse_captions", parse_captions)
+data_dict, labels = checkpoint.stage("encode", encode, label_matrix, captions_dict)
+
+
+# 逐行校验：列长度、标签非空、行顺序
+checkpoint.stage("verify", check_dataset, data_dict)
+
+# 保存为.pkl文件（pikle格式），--format mat 时导出为mat文件
+out_dir = checkpoint.stage("write", save_dataset, data_dict, args, "flickr25k")
+# 标签统计（每个类别的图像数量、共现矩阵、标签数分布），缓存为 flickr25k_stats.npz / .json
+class_names = [item.replace(".txt", "") for item in file_list]  # 类别名称，顺序与标签列一致
+print_stats(save_stats(labels, out_dir, "flickr25k", class_names), class_names)
+checkpoint.finish()
+
+
+print(f"finished!see {out_dir}")  # 完成提示
\ No newline at end of file
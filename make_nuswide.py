@@ -1,7 +1,22 @@
 # 导入必要的库
 import os  # 操作系统接口
 import numpy as np  # 数值计算库
-import pickle # 导入pickle模块 - Python内置的序列化模块
+import argparse  # 命令行参数解析库
+from contextlib import ExitStack  # 同时打开多个文件
+from itertools import zip_longest  # 逐行同步读取多个文件，检查行数
+from dataset_io import add_output_args, save_dataset, check_dataset, DatasetWriter  # 数据集保存/导出
+from dataset_stats import save_stats, print_stats  # 标签统计
+from checkpoint import add_checkpoint_args, BuildCheckpoint  # 构建检查点
+
+# 命令行参数：输出格式/目录（--format mat 导出为mat文件），--resume 从中断处继续
+parser = argparse.ArgumentParser()
+add_output_args(parser)
+add_checkpoint_args(parser, "nuswide")
+args = parser.parse_args()
+
+# 构建检查点：parse -> verify -> write，每个阶段完成后保存结果
+config = {key: value for key, value in vars(args).items() if key not in ("resume", "scratch_dir")}
+checkpoint = BuildCheckpoint(args.scratch_dir, ["parse", "verify", "write"], args.resume, config)
 
 
 # 设置NUS-WIDE数据集的根目录
@@ -16,140 +31,116 @@ textFile = os.path.join(root_dir, "NUS_WID_Tags/All_Tags.txt") # 图像ID、文
 # 真实图像文件夹路径
 imagePath = "images/Flickr"
 
-# ============ 1. 加载图像索引 ============
-with open(imageListFile, "r") as f:
-    indexs = f.readlines()  # 读取所有行，每行是一个图像路径。返回一个列表，列表中的每个元素是文件的一行（字符串）每行末尾包含换行符 \n
+# ============ 1. 加载使用的标签列表 ============
+# 加载使用的标签列表（NUS-WIDE常用的类别）【从81个类别中选取常用的类别】
+with open(os.path.join(root_dir, "ConceptsList/Concepts81_sort.txt")) as f:
+    label_lists = f.readlines()  # 读取标签文件的所有行,返回一个列表，列表中的每个元素是文件的一行（字符串）每行末尾包含换行符 \n
 
-# 处理图像路径：去除换行符，将反斜杠\替换为正斜杠/, 添加完整路径前缀
-indexs = [os.path.join(imagePath, item.strip()).replace("\\", "/") for item in indexs]
-print("indexs length:", len(indexs))  # 打印图像数量
-print(indexs[0:2])
-# [img1,img2...img269648]
+label_lists = [item.strip() for item in label_lists[0:21]]  # 只取常见类别，去除换行符
+# ["cat","dog",..."class21"]
 
 
+# 逐行读取文本描述
+def read_tags(f):
+    """
+    逐行读取 All_Tags.txt，生成每张图像的 (Flickr图像ID, 文本描述)
 
-# ============ 2. 加载文本描述 ============
-captions = []  # 存储文本描述的列表
-with open(textFile, "r",encoding="utf-8") as f:
+    第一列是Flickr图像ID，后面是标签词；空行跳过，描述为空时使用占位符
+    """
     for line in f:
         if len(line.strip()) == 0:  # 跳过空行
             print("some line empty!")
             continue
 
         # 处理文本行：第一列可能是索引，后面是标签词
-        caption = line.split()[1:]  # 跳过第一列（图像ID）
+        words = line.split()
+        photo_id = int(words[0])  # 第一列：Flickr图像ID
+        caption = words[1:]  # 跳过第一列（图像ID）
         caption = " ".join(caption).strip()  # 用空格连接标签词
 
         if len(caption) == 0:  # 如果描述为空，使用占位符
             caption = "123456"  # 占位文本
 
-        captions.append(caption)  # 添加到列表
-
-print("captions length:", len(captions))  # 打印描述数量
-print(captions[0:2])
-# [text1,text2...text269648]
-
-
-# ============ 3. 加载标签（类别）信息 ============
-# 加载使用的标签列表（NUS-WIDE常用的类别）【从81个类别中选取常用的类别】
-with open(os.path.join(root_dir, "ConceptsList/Concepts81_sort.txt")) as f:
-    label_lists = f.readlines()  # 读取标签文件的所有行,返回一个列表，列表中的每个元素是文件的一行（字符串）每行末尾包含换行符 \n
-
-label_lists = [item.strip() for item in label_lists[0:21]]  # 只取常见类别，去除换行符
-# ["cat","dog",..."class21"]
-
-# 创建类别索引映射（标签名 -> 索引位置）
-class_index = {}
-for i, item in enumerate(label_lists):
-    class_index.update({item: i})  # 映射关系，如："animal" -> 0
-# {"cat":0,"dog":1,..."class21":20}
-
-# 创建标签矩阵：形状为[图像数量, 类别数量]，数据类型为int8（节省内存）
-labels = np.zeros([len(indexs), len(class_index)], dtype=np.int8)
-# [0,0,...0]
-# [0,0,...0]
-#  ........
-# [0,0,...0]
-
-# 通过类别标签文件填充编码矩阵
-for item in label_lists:
-    path = os.path.join(labelPath, "Labels_"+item+".txt")  # 标签文件路径【n行0-1】
-    class_label = item  # 类别名称
-
-    with open(path, "r") as f:
-        data = f.readlines()  # 读取标签文件的所有行【1行对应一个图像】
-
-    # 为每个图像设置该类别标签
-    for i, val in enumerate(data):
-        # 如果值为"1"，表示该图像属于该类别【多标签独热编码】
-        labels[i][class_index[class_label]] = 1 if val.strip() == "1" else 0
-
-print("labels sum:", labels.sum())  # 打印所有标签的总和（统计正样本数量）
-print(labels[0:2])
-# [[0,1,...0],[],...,[]]
-
-
-# ============ 4. 过滤全 0 标签的图像（推荐方式） ============
-# labels: [num_images, num_classes]
-
-# 1. 计算每个样本是否至少有一个标签
-valid_mask = labels.sum(axis=1) > 0    # shape: [num_images]
-# [true,false,.......]
+        yield photo_id, caption
+
+
+# ============ 2. 流式读取并过滤全 0 标签的图像 ============
+# 图像索引、文本描述、21个类别标签文件【n行0-1】逐行同步读取，
+# 每行当场判断是否至少有一个标签，只把保留的行追加到写入器，
+# 不再整体读入 Imagelist.txt / All_Tags.txt，也不构建 [269648, 21] 的完整标签矩阵和过滤后的副本
+def stream_rows():
+    """逐行读取并过滤，返回 (数据集字典, 读取的图像数量)"""
+    writer = DatasetWriter(len(label_lists))
+    total = 0  # 读取的图像数量
+    label = np.zeros(len(label_lists), dtype=np.int8)  # 当前行的多标签独热编码
+
+    with ExitStack() as stack:
+        image_file = stack.enter_context(open(imageListFile, "r"))
+        text_file = stack.enter_context(open(textFile, "r", encoding="utf-8"))
+        label_files = [stack.enter_context(open(os.path.join(labelPath, "Labels_" + item + ".txt"), "r"))
+                       for item in label_lists]
+        tags = read_tags(text_file)
+
+        # 各文件行数应一致：用 zip_longest 读到最长的文件，先读完的文件补 None，
+        # 这样差一行的情况也能发现（zip 会在最短的文件处静默停止）
+        names = [imageListFile, textFile] + [f.name for f in label_files]
+        for row in zip_longest(image_file, tags, *label_files):
+            if None in row:
+                short = [name for name, item in zip(names, row) if item is None]
+                raise ValueError(f"图像索引、文本描述和标签文件的行数不一致: 第{total + 1}行时已读完 {short}")
+            index, (photo_id, caption), *values = row
+            total += 1
+            # 如果值为"1"，表示该图像属于该类别【多标签独热编码】
+            for i, val in enumerate(values):
+                label[i] = 1 if val.strip() == "1" else 0
+            if not label.any():  # 不在选定类别中的图像直接丢弃
+                continue
+            # 图像ID使用Flickr图像ID：All_Tags.txt 的第一列，也是图像文件名 {编号}_{Flickr图像ID}.jpg 的后缀，两者应一致
+            index = index.strip()
+            if os.path.splitext(index)[0].rsplit("_", 1)[-1] != str(photo_id):
+                raise ValueError(f"图像索引和文本描述不对应: 第{total}行, {index} vs 图像ID {photo_id}")
+            # 处理图像路径：去除换行符，将反斜杠\替换为正斜杠/, 添加完整路径前缀
+            writer.append(os.path.join(imagePath, index).replace("\\", "/"), caption, label, photo_id)
+
+    return writer.finish(), total
+
+
+# 读取阶段（parse）：流式读取、过滤并编码，结果保存到检查点
+data_dict, total = checkpoint.stage("parse", stream_rows)
+indexs, captions, labels = data_dict["indexs"], data_dict["captions"], data_dict["labels"]
 
 print("before filtering:")
-print("indexs length:", len(indexs))
-print("captions length:", len(captions))
-print("labels shape:", labels.shape)
-
-# 2. 根据 mask 过滤 indexs、captions、labels【只保留True(在选定类别中)的部分】
-indexs = [idx for idx, keep in zip(indexs, valid_mask) if keep]
-captions = [cap for cap, keep in zip(captions, valid_mask) if keep]
-labels = labels[valid_mask]
-
-# 等价于
-# new_indexs = []
-# new_captions = []
-# for i in range(len(labels)):
-#     if labels[i].sum() > 0:
-#         new_indexs.append(indexs[i])
-#         new_captions.append(captions[i])
-# indexs = new_indexs
-# captions = new_captions
-# labels = labels[labels.sum(axis=1) > 0]
+print("indexs length:", total)
 
 print("after filtering:")
 print("indexs length:", len(indexs)) # 打印过滤后的图像数量
 print("captions length:", len(captions)) # 打印过滤后的描述数量
 print("labels shape:", labels.shape) # 打印标签矩阵的形状
 print("labels sum:", labels.sum()) #打印标签矩阵有多少个1【多标签】
-
-
-print("\n===== 每个类别的图像数量 =====")
-for i, class_name in enumerate(label_lists):
-    num = labels[:, i].sum()
-    print(f"{class_name:20s}: {num}")
+print(indexs[0:2])
+print(captions[0:2])
+print(labels[0:2])
 
 
 
-# ============ 5. 保存为pkl格式文件 ============
+# ============ 3. 保存为pkl格式文件 ============
 # 把Python对象（如列表、字典、numpy数组等）转换成二进制格式并保存到文件中。
 # 准备保存的数据结构
 data_dict = {"indexs": indexs, # 图片索引
                "captions": captions, # 文本描述
-               "labels": labels}  # 标签矩阵
+               "labels": labels,  # 标签矩阵
+               "ids": data_dict["ids"],  # Flickr图像ID
+               "splits": data_dict["splits"]}  # 所属子集（全部为0）
 
 
-# 保存为.pkl文件（pikle格式）
-# ============ 创建 mat 目录（如果不存在） ============
-pkl_dir = "pkl_dataset"
-os.makedirs(pkl_dir, exist_ok=True)
+# 逐行校验：列长度、标签非空、图像ID不重复（行按 Imagelist.txt 的顺序，不按ID排序）
+checkpoint.stage("verify", check_dataset, data_dict, ordered=False)
 
-#  保存为pickle格式（Python原生，加载最快）
-# "wb"参数：w=写入模式，b=二进制模式（pickle需要二进制）
-# pickle.dump()函数：将Python对象序列化并写入文件
-# 函数语法：pickle.dump(要保存的对象, 文件对象, 协议版本)
-with open(os.path.join(pkl_dir, "nuswide.pkl"), "wb") as f:
-    pickle.dump(data_dict, f)
+# 保存为.pkl文件（pikle格式），--format mat 时导出为mat文件
+out_dir = checkpoint.stage("write", save_dataset, data_dict, args, "nuswide")
+# 标签统计（每个类别的图像数量、共现矩阵、标签数分布），缓存为 nuswide_stats.npz / .json
+print_stats(save_stats(labels, out_dir, "nuswide", label_lists), label_lists)
+checkpoint.finish()
 
 
-print(f"finished!see {pkl_dir}")  # 完成提示
\ No newline at end of file
+print(f"finished!see {out_dir}")  # 完成提示
\ No newline at end of file